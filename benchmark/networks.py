@@ -0,0 +1,129 @@
+# general imports
+import math
+import random
+
+# a network is a list of features, a feature is a list of parts, a part is a list of (x, y) vertices
+# every generator is deterministic so the same scenario always gives the same network
+
+SCENARIOS = ['grid', 'radial', 'rural', 'dirty']
+
+# size parameter of the generators per scale
+SCALES = {'small': 10, 'medium': 40, 'large': 120}
+
+
+def grid(size, spacing=100.0, pieces=2):
+    # size x size blocks: the rows run from side to side with a vertex at every crossing (to be
+    # broken) and the columns are cut in pieces between the crossings (to be merged)
+    features = []
+    for j in xrange(size + 1):
+        features.append([[(i * spacing, j * spacing) for i in xrange(size + 1)]])
+    for i in xrange(size + 1):
+        x = i * spacing
+        for j in xrange(size):
+            for k in xrange(pieces):
+                y0 = j * spacing + k * spacing / pieces
+                features.append([[(x, y0), (x, y0 + spacing / pieces)]])
+    return features
+
+
+def radial(rings, spokes=16, spacing=100.0, pieces=2, arc_vertices=4):
+    # spokes from the centre with a vertex at every ring (to be broken) and rings made of
+    # arcs between the spokes, each arc cut in pieces (to be merged)
+    features = []
+    for s in xrange(spokes):
+        angle = 2 * math.pi * s / spokes
+        features.append([[(r * spacing * math.cos(angle), r * spacing * math.sin(angle)) for r in xrange(rings + 1)]])
+    arc_steps = pieces * arc_vertices
+    for r in xrange(1, rings + 1):
+        radius = r * spacing
+        for s in xrange(spokes):
+            for k in xrange(pieces):
+                part = []
+                for v in xrange(arc_vertices + 1):
+                    angle = 2 * math.pi * (s + (k * arc_vertices + v) / float(arc_steps)) / spokes
+                    part.append((radius * math.cos(angle), radius * math.sin(angle)))
+                features.append([part])
+    return features
+
+
+def rural(chains, length=20, spacing=50.0, seed=0):
+    # a trunk road with long chains of short segments branching off it, every chain turns
+    # a little at each joint so it merges into one line
+    rnd = random.Random(seed)
+    features = [[[(c * 4 * spacing, 0.0) for c in xrange(chains)]]]
+    for c in xrange(chains):
+        x, y = c * 4 * spacing, 0.0
+        heading = math.pi / 2
+        for s in xrange(length):
+            heading += math.radians(rnd.uniform(-2, 2))
+            next_x, next_y = x + spacing * math.cos(heading), y + spacing * math.sin(heading)
+            features.append([[(x, y), (next_x, next_y)]])
+            x, y = next_x, next_y
+    return features
+
+
+def with_duplicates(features, rate, seed=0):
+    # copies of a share of the single part features, half of them reversed
+    rnd = random.Random(seed)
+    copies = []
+    for feature in features:
+        if len(feature) == 1 and rnd.random() < rate:
+            part = list(feature[0])
+            if rnd.random() < 0.5:
+                part.reverse()
+            copies.append([part])
+    return features + copies
+
+
+def with_overlaps(features, rate, seed=0):
+    # lines covering the start of a share of the single part features
+    rnd = random.Random(seed)
+    overlaps = []
+    for feature in features:
+        if len(feature) == 1 and rnd.random() < rate:
+            part = feature[0]
+            if len(part) > 2:
+                overlaps.append([part[:2]])
+            else:
+                (x0, y0), (x1, y1) = part
+                overlaps.append([[(x0, y0), ((x0 + x1) / 2, (y0 + y1) / 2)]])
+    return features + overlaps
+
+
+def with_multiparts(features, rate, seed=0):
+    # joins a share of consecutive single part features into multipart features
+    rnd = random.Random(seed)
+    joined = []
+    pending = None
+    for feature in features:
+        if pending is not None:
+            joined.append(pending + feature)
+            pending = None
+        elif len(feature) == 1 and rnd.random() < rate:
+            pending = feature
+        else:
+            joined.append(feature)
+    if pending is not None:
+        joined.append(pending)
+    return joined
+
+
+def scenario(name, scale):
+    size = SCALES[scale]
+    if name == 'grid':
+        return grid(size)
+    elif name == 'radial':
+        return radial(size, spokes=max(16, size))
+    elif name == 'rural':
+        return rural(size * 4)
+    elif name == 'dirty':
+        # a grid with duplicates, overlaps and multipart features
+        return with_multiparts(with_overlaps(with_duplicates(grid(size), 0.05, 1), 0.05, 2), 0.05, 3)
+    raise ValueError('unknown scenario: %s' % name)
+
+
+def feature_wkt(feature):
+    parts = ['(' + ', '.join(['%r %r' % (x, y) for x, y in part]) + ')' for part in feature]
+    if len(parts) == 1:
+        return 'LINESTRING' + parts[0]
+    return 'MULTILINESTRING(' + ', '.join(parts) + ')'
@@ -0,0 +1,46 @@
+# general imports
+import json
+
+
+def phase_results(profile):
+    # the figures of a RunProfile that are compared between runs
+    return dict((record['name'], {'wall_time': record['wall_time'], 'cpu_time': record['cpu_time'],
+                                  'peak_rss_mb': record['peak_rss_mb'], 'counters': record['counters']})
+                for record in profile.report()['phases'])
+
+
+def load_results(path):
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+def save_results(results, path):
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+
+
+def compare_results(results, baseline, threshold=1.25, min_time=0.05):
+    # regressions of results against the baseline, as messages
+    # a phase regresses when it is threshold times slower and at least min_time seconds slower,
+    # or when one of its counters (geos calls, index queries) grows threshold times
+    regressions = []
+    for run_name in sorted(results['runs'].keys()):
+        try:
+            base_run = baseline['runs'][run_name]
+        except KeyError:
+            continue
+        run = results['runs'][run_name]
+        for phase_name in sorted(run['phases'].keys()):
+            try:
+                base_phase = base_run['phases'][phase_name]
+            except KeyError:
+                continue
+            phase = run['phases'][phase_name]
+            old, new = base_phase['wall_time'], phase['wall_time']
+            if new > old * threshold and new - old > min_time:
+                regressions.append('%s %s: %.2fs -> %.2fs' % (run_name, phase_name, old, new))
+            for counter, old_count in sorted(base_phase['counters'].items()):
+                new_count = phase['counters'].get(counter, 0)
+                if new_count > old_count * threshold:
+                    regressions.append('%s %s %s: %d -> %d' % (run_name, phase_name, counter, old_count, new_count))
+    return regressions
@@ -0,0 +1,128 @@
+# coding=utf-8
+"""This script times the cleaning of synthetic road networks.
+
+Every scenario (grid, radial city, rural chains, grid with duplicates,
+overlaps and multipart features) is generated at each requested scale,
+loaded in a memory layer and cleaned with breakTool and mergeTool. The
+cleaned network is then written to a shapefile and a GeoPackage. The
+timings and the GEOS and spatial index counts of every phase are written
+to a json file, and compared with a baseline json file when one is given.
+The exit status is 1 when a phase regressed.
+
+Run it from the plugin directory:
+    python -m benchmark.run -s small,medium -o results.json -b baseline.json
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+from optparse import OptionParser
+
+from qgis.core import QgsApplication, QgsVectorLayer, QgsFeature, QgsGeometry
+
+from sGraph.break_tools import breakTool
+from sGraph.merge_tools import mergeTool
+from sGraph.utilityFunctions import add_in_batches, to_shp, to_gpkg
+from sGraph.profiling import RunProfile
+from benchmark.networks import SCENARIOS, SCALES, scenario, feature_wkt
+from benchmark.results import phase_results, load_results, save_results, compare_results
+
+
+def network_layer(features, name):
+    layer = QgsVectorLayer('LineString?crs=epsg:27700&field=id:integer', name, 'memory')
+    new_features = []
+    for fid, feature in enumerate(features, start=1):
+        new_feat = QgsFeature()
+        new_feat.setAttributes([fid])
+        new_feat.setGeometry(QgsGeometry.fromWkt(feature_wkt(feature)))
+        new_features.append(new_feat)
+    add_in_batches(layer.dataProvider(), new_features, 10000)
+    layer.updateExtents()
+    return layer
+
+
+def run_scenario(name, scale, tolerance, out_dir):
+    features = scenario(name, scale)
+    layer = network_layer(features, '%s_%s' % (name, scale))
+    crs = layer.dataProvider().crs()
+    encoding = layer.dataProvider().encoding()
+    geom_type = layer.dataProvider().geometryType()
+
+    profile = RunProfile()
+    br = breakTool(layer, tolerance, None, True, True, profile=profile)
+    br.add_edges()
+    broken_features = br.break_features()
+    br.find_unlinks(broken_features)
+    mrg = mergeTool(broken_features, None, True, profile=profile)
+    merged_features = mrg.merge()
+
+    with profile.phase('to_shp'):
+        to_shp(os.path.join(out_dir, '%s_%s.shp' % (name, scale)), merged_features, br.layer_fields, crs, 'cleaned',
+               encoding, geom_type)
+    with profile.phase('to_gpkg'):
+        to_gpkg(os.path.join(out_dir, '%s_%s.gpkg' % (name, scale)), merged_features, br.layer_fields, crs, 'cleaned',
+                encoding, geom_type)
+
+    return {'features': len(features), 'broken': len(broken_features), 'cleaned': len(merged_features),
+            'unlinks': len(br.unlinked_features), 'phases': phase_results(profile)}
+
+
+def main(parameters):
+    QgsApplication.setPrefixPath(parameters.prefix, True)
+    app = QgsApplication([], False)
+    app.initQgis()
+
+    results = {'tolerance': parameters.tolerance, 'runs': {}}
+    out_dir = tempfile.mkdtemp()
+    try:
+        for scale in parameters.scales.split(','):
+            for name in parameters.scenarios.split(','):
+                run = run_scenario(name, scale, parameters.tolerance, out_dir)
+                results['runs']['%s/%s' % (name, scale)] = run
+                print '%-16s %8d features %8d broken %8d cleaned %8.2fs' % (
+                    '%s/%s' % (name, scale), run['features'], run['broken'], run['cleaned'],
+                    sum([phase['wall_time'] for phase_name, phase in run['phases'].items()
+                         if phase_name in ('add_edges', 'break_features', 'mergeTool.__init__', 'merge')]))
+    finally:
+        shutil.rmtree(out_dir)
+    app.exitQgis()
+
+    if parameters.output:
+        save_results(results, parameters.output)
+
+    if parameters.baseline:
+        regressions = compare_results(results, load_results(parameters.baseline), parameters.threshold)
+        for regression in regressions:
+            print 'regression: %s' % regression
+        if regressions:
+            return 1
+        print 'no regressions against %s' % parameters.baseline
+    return 0
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option(
+        "-s", "--scales", dest="scales", default="small",
+        help="Comma separated scales among %s" % ', '.join(sorted(SCALES.keys())), metavar="small")
+    parser.add_option(
+        "--scenarios", dest="scenarios", default=','.join(SCENARIOS),
+        help="Comma separated scenarios among %s" % ', '.join(SCENARIOS), metavar="grid")
+    parser.add_option(
+        "-t", "--tolerance", dest="tolerance", type="int", default=6,
+        help="Snap coordinates to this number of decimals", metavar="6")
+    parser.add_option(
+        "-o", "--output", dest="output",
+        help="Write the results to this json file (use it later as a baseline)", metavar="results.json")
+    parser.add_option(
+        "-b", "--baseline", dest="baseline",
+        help="Compare the results with this json file", metavar="baseline.json")
+    parser.add_option(
+        "--threshold", dest="threshold", type="float", default=1.25,
+        help="Slowdown ratio reported as a regression", metavar="1.25")
+    parser.add_option(
+        "--prefix", dest="prefix", default=os.environ.get('QGIS_PREFIX_PATH', '/usr'),
+        help="QGIS installation prefix", metavar="/usr")
+    options, args = parser.parse_args()
+    sys.exit(main(options))
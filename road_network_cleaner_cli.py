@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""This script cleans a road centre line map without the QGIS GUI.
+
+It reads the network from a file, breaks and merges it with the plugin
+tools and writes the cleaned network to a shapefile, GeoPackage or
+FlatGeobuf file (chosen from the extension), and optionally the errors and
+the unlinks to shapefiles. The wall time, cpu time and peak memory of each
+phase are reported at the end, and optionally written as json.
+
+With --state the run keeps the broken and merged network in a state file;
+a later run with the same state and --changed and/or --extent re-cleans
+only the edited features and patches the cleaned file in place.
+
+With --server the input and the output are PostGIS tables (schema.table)
+and the whole cleaning runs as queries in the database; the errors and the
+unlinks are written to tables too.
+
+Example:
+    python road_network_cleaner_cli.py -t 6 -e errors.shp roads.shp cleaned.shp
+    python road_network_cleaner_cli.py -t 6 --state roads.state roads.shp cleaned.gpkg
+    python road_network_cleaner_cli.py --state roads.state --changed 12,40 roads.shp cleaned.gpkg
+    python road_network_cleaner_cli.py --server "dbname=gis" -t 6 -e roads_errors roads cleaned.roads
+"""
+
+import os
+import sys
+from optparse import OptionParser
+
+from qgis.core import QgsApplication, QgsVectorLayer, QgsField
+from PyQt4.QtCore import QVariant
+
+from sGraph.break_tools import breakTool
+from sGraph.merge_tools import mergeTool
+from sGraph.incremental_tools import incrementalTool
+from sGraph.utilityFunctions import to_shp, to_file
+from sGraph.profiling import RunProfile
+from sGraph.break_cache import BreakCache
+
+
+def clean_in_database(parameters, input_table, output_table):
+    """Cleans a PostGIS table into another without reading the features.
+
+    :param parameters: Command line parameters.
+    :param input_table: Input table, as schema.table.
+    :param output_table: Output table, as schema.table.
+    """
+    # only the database cleaning needs psycopg2
+    try:
+        import psycopg2
+        from sGraph.postgis_tools import postgisTool, table_name
+    except ImportError, e:
+        print "Could not clean in the database: %s" % e
+        return 1
+    schema, table = table_name(input_table)
+    profile = RunProfile()
+    cleaner = postgisTool(parameters.server, schema, table, parameters.tolerance,
+                          parameters.errors is not None, parameters.unlinks is not None,
+                          snap_mode=parameters.snap_mode, geom_column=parameters.geom_column,
+                          id_column=parameters.id_column, angle_threshold=parameters.angle_threshold,
+                          orphan_edges=parameters.orphan_edges, orphan_length=parameters.orphan_length,
+                          profile=profile)
+    out_schema, out_table = table_name(output_table, schema)
+    errors_table = table_name(parameters.errors, schema) if parameters.errors else None
+    unlinks_table = table_name(parameters.unlinks, schema) if parameters.unlinks else None
+    try:
+        counts = cleaner.clean(out_schema, out_table, errors_table, unlinks_table)
+    except psycopg2.Error, e:
+        print "Could not clean %s: %s" % (input_table, e)
+        return 1
+    print "%s: %s edges read, %s broken, %s cleaned" % (input_table, counts['edges'], counts['broken'],
+                                                         counts['cleaned'])
+
+    print profile.summary()
+    if parameters.profile:
+        profile.to_json(parameters.profile)
+    return 0
+
+
+def main(parameters, arguments):
+    """Main entry point.
+
+    :param parameters: Command line parameters.
+    :param arguments: Command line arguments (input and output path).
+    """
+    input_path, output_path = arguments
+
+    if parameters.server:
+        return clean_in_database(parameters, input_path, output_path)
+
+    QgsApplication.setPrefixPath(parameters.prefix, True)
+    app = QgsApplication([], False)
+    app.initQgis()
+
+    layer = QgsVectorLayer(input_path, os.path.splitext(os.path.basename(input_path))[0], 'ogr')
+    if not layer.isValid():
+        print "Could not read layer: %s" % input_path
+        app.exitQgis()
+        return 1
+
+    crs = layer.dataProvider().crs()
+    encoding = layer.dataProvider().encoding()
+    geom_type = layer.dataProvider().geometryType()
+    errors = parameters.errors is not None
+    unlinks = parameters.unlinks is not None
+
+    profile = RunProfile()
+
+    if parameters.state and (parameters.changed or parameters.extent):
+        cleaner = incrementalTool.load(parameters.state, profile)
+        changed_ids = [int(fid) for fid in parameters.changed.split(',')] if parameters.changed else None
+        extent = tuple([float(c) for c in parameters.extent.split(',')]) if parameters.extent else None
+        removed, added = cleaner.reclean(layer, changed_ids, extent)
+        with profile.phase('patch_layer') as record:
+            cleaner.patch_layer(QgsVectorLayer(output_path, 'cleaned', 'ogr'), removed, added)
+            record['features'] += len(added)
+        cleaner.save(parameters.state)
+        errors_list, unlinks_list = cleaner.errors_list(), cleaner.unlinks_list()
+        print "%s: %s cleaned lines replaced by %s" % (input_path, len(removed), len(added))
+
+    elif parameters.state:
+        cleaner = incrementalTool(parameters.tolerance, errors, unlinks, snap_mode=parameters.snap_mode,
+                                  break_engine=parameters.break_engine, profile=profile)
+        merged_features = cleaner.clean(layer)
+        with profile.phase('to_file') as record:
+            to_file(output_path, merged_features, cleaner.layer_fields, crs, 'cleaned', encoding, geom_type)
+            record['features'] += len(merged_features)
+        cleaner.save(parameters.state)
+        errors_list, unlinks_list = cleaner.errors_list(), cleaner.unlinks_list()
+        print "%s: %s broken, %s cleaned" % (input_path, len(cleaner.pieces), len(merged_features))
+
+    else:
+        br = breakTool(layer, parameters.tolerance, None, errors, unlinks, snap_mode=parameters.snap_mode,
+                       break_engine=parameters.break_engine, workers=parameters.workers,
+                       spill_dir=parameters.spill_dir, profile=profile)
+        if parameters.cache_dir:
+            cache = BreakCache(os.path.expanduser(parameters.cache_dir), parameters.cache_size * 1024 * 1024)
+            with profile.phase('cache_key'):
+                cache_key = br.cache_key(cache)
+            entry = cache.get(cache_key)
+        else:
+            entry = None
+        if entry is not None:
+            broken_features = br.restore(entry)
+        else:
+            br.add_edges(parameters.chunk_size)
+            broken_features = br.break_features()
+            if unlinks:
+                br.find_unlinks(broken_features)
+            if parameters.cache_dir:
+                cache.put(cache_key, br.cache_entry(broken_features))
+
+        mrg = mergeTool(broken_features, None, True, profile=profile, angle_threshold=parameters.angle_threshold,
+                        orphan_edges=parameters.orphan_edges, orphan_length=parameters.orphan_length)
+        merged_features = mrg.merge()
+
+        with profile.phase('to_file') as record:
+            to_file(output_path, merged_features, br.layer_fields, crs, 'cleaned', encoding, geom_type)
+            record['features'] += len(merged_features)
+        if errors:
+            br.updateErrors(mrg.errors_features)
+        errors_list = [[k, [[k], [v[0]]], v[1]] for k, v in br.errors_features.items()]
+        unlinks_list = br.unlinked_features
+        print "%s: %s edges read, %s broken, %s cleaned" % (
+            input_path, len(br.store), len(broken_features), len(merged_features))
+        br.close()
+
+    if errors:
+        errors_fields = [QgsField('id_input', QVariant.Int), QgsField('errors', QVariant.String)]
+        with profile.phase('to_shp') as record:
+            to_shp(parameters.errors, errors_list, errors_fields, crs, 'errors', encoding, geom_type)
+            record['features'] += len(errors_list)
+    if unlinks:
+        unlinks_fields = [QgsField('id', QVariant.Int), QgsField('line_id1', QVariant.Int),
+                          QgsField('line_id2', QVariant.Int), QgsField('x', QVariant.Double),
+                          QgsField('y', QVariant.Double)]
+        with profile.phase('to_shp') as record:
+            to_shp(parameters.unlinks, unlinks_list, unlinks_fields, crs, 'unlinks', encoding, 0)
+            record['features'] += len(unlinks_list)
+
+    print profile.summary()
+    if parameters.profile:
+        profile.to_json(parameters.profile)
+
+    app.exitQgis()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options] input_network output.shp|.gpkg|.fgb|schema.table")
+    parser.add_option(
+        "-t", "--tolerance", dest="tolerance", type="int",
+        help="Snap coordinates to this number of decimals", metavar="6")
+    parser.add_option(
+        "--snap-mode", dest="snap_mode", default="truncate", choices=["truncate", "round"],
+        help="Snapping: truncate the extra decimals or round to the grid", metavar="truncate")
+    parser.add_option(
+        "-e", "--errors", dest="errors",
+        help="Write the errors to this shapefile (a table with --server)", metavar="errors.shp")
+    parser.add_option(
+        "-u", "--unlinks", dest="unlinks",
+        help="Write the unlinks to this shapefile (a table with --server)", metavar="unlinks.shp")
+    parser.add_option(
+        "--angle-threshold", dest="angle_threshold", type="float", default=5,
+        help="Merge lines at a node only if they turn by at most this angle (degrees)", metavar="5")
+    parser.add_option(
+        "--orphan-edges", dest="orphan_edges", type="int", default=2,
+        help="Leave out the isolated parts of the network with at most this many lines", metavar="2")
+    parser.add_option(
+        "--orphan-length", dest="orphan_length", type="float",
+        help="Leave out the isolated parts of the network shorter than this", metavar="100")
+    parser.add_option(
+        "--break-engine", dest="break_engine", default="geos", choices=["geos", "vertex"],
+        help="Find breaks with geos intersections or from the shared vertices", metavar="geos")
+    parser.add_option(
+        "-w", "--workers", dest="workers", type="int", default=1,
+        help="Number of processes of the break phase", metavar="1")
+    parser.add_option(
+        "--chunk-size", dest="chunk_size", type="int",
+        help="Read and snap the features in chunks of this size", metavar="100000")
+    parser.add_option(
+        "--spill-dir", dest="spill_dir",
+        help="Keep the edges in files in this directory (streaming mode)", metavar="/tmp/network")
+    parser.add_option(
+        "--cache-dir", dest="cache_dir",
+        help="Keep the broken network in this directory, runs on the same input skip the break",
+        metavar="~/.cache/rcl")
+    parser.add_option(
+        "--cache-size", dest="cache_size", type="int", default=512,
+        help="Size of the cache in MB, the least recently used entries are removed", metavar="512")
+    parser.add_option(
+        "--state", dest="state",
+        help="Keep the broken and merged network in this file, for incremental runs", metavar="roads.state")
+    parser.add_option(
+        "--changed", dest="changed",
+        help="Comma separated ids of the edited features: patch the output with them (needs --state)",
+        metavar="12,40")
+    parser.add_option(
+        "--extent", dest="extent",
+        help="Re-clean the features in this extent: patch the output with them (needs --state)",
+        metavar="xmin,ymin,xmax,ymax")
+    parser.add_option(
+        "--server", dest="server",
+        help="Clean PostGIS tables in the database of this connection string", metavar="dbname=gis")
+    parser.add_option(
+        "--geom-column", dest="geom_column", default="geom",
+        help="Geometry column of the input table (with --server)", metavar="geom")
+    parser.add_option(
+        "--id-column", dest="id_column", default="id",
+        help="Id column of the input table (with --server)", metavar="id")
+    parser.add_option(
+        "--profile", dest="profile",
+        help="Write the timings of the phases to this json file", metavar="profile.json")
+    parser.add_option(
+        "--prefix", dest="prefix", default=os.environ.get('QGIS_PREFIX_PATH', '/usr'),
+        help="QGIS installation prefix", metavar="/usr")
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        print "Please specify the input network and the output file.\n"
+        parser.print_help()
+        sys.exit(1)
+    if (options.changed or options.extent) and not options.state:
+        parser.error("--changed/--extent need --state")
+    if not options.server and os.path.splitext(args[1])[1].lower() not in ('.shp', '.gpkg', '.fgb'):
+        parser.error("the output file must be a .shp, .gpkg or .fgb file")
+    sys.exit(main(options, args))
@@ -22,6 +22,7 @@
 """
 from PyQt4 import QtGui, uic
 from PyQt4.QtCore import pyqtSignal, Qt
+from qgis.core import QgsVectorFileWriter
 
 import os.path
 import resources
@@ -118,6 +119,7 @@ class RoadNetworkCleanerDialog(QtGui.QDialog, FORM_CLASS):
         self.disable_browse()
         self.unlinksCheckBox.setDisabled(onoff)
         self.errorsCheckBox.setDisabled(onoff)
+        self.cacheCheckBox.setDisabled(onoff)
         self.cleanButton.setDisabled(onoff)
 
     def getTolerance(self):
@@ -138,6 +140,9 @@ class RoadNetworkCleanerDialog(QtGui.QDialog, FORM_CLASS):
     def get_unlinks(self):
         return self.unlinksCheckBox.isChecked()
 
+    def get_cache(self):
+        return self.cacheCheckBox.isChecked()
+
     def update_output_text(self):
         if self.memoryRadioButton.isChecked():
             return "cleaned"
@@ -160,7 +165,8 @@ class RoadNetworkCleanerDialog(QtGui.QDialog, FORM_CLASS):
 
     def get_settings(self):
         settings = {'input': self.getNetwork(), 'output': self.getOutput(), 'tolerance': self.getTolerance(),
-                    'errors': self.get_errors(), 'unlinks': self.get_unlinks(),  'user_id': None, 'output_type': self.get_output_type()}
+                    'errors': self.get_errors(), 'unlinks': self.get_unlinks(),  'user_id': None, 'output_type': self.get_output_type(),
+                    'cache': self.get_cache()}
         return settings
 
     def get_dbsettings(self):
@@ -169,8 +175,17 @@ class RoadNetworkCleanerDialog(QtGui.QDialog, FORM_CLASS):
 
     def setOutput(self):
         if self.shpRadioButton.isChecked():
-            self.file_name = QtGui.QFileDialog.getSaveFileName(self, "Save output file ", "cleaned_network", '*.shp')
+            file_filter = 'ESRI Shapefile (*.shp);;GeoPackage (*.gpkg)'
+            # the FlatGeobuf driver comes with GDAL 3.1
+            if 'FlatGeobuf' in QgsVectorFileWriter.ogrDriverList().values():
+                file_filter += ';;FlatGeobuf (*.fgb)'
+            self.file_name, selected_filter = QtGui.QFileDialog.getSaveFileNameAndFilter(
+                self, "Save output file ", "cleaned_network", file_filter)
             if self.file_name:
+                # a name without the extension of one of the formats gets the one of the selected format
+                extensions = [f[f.index('*') + 1:-1] for f in file_filter.split(';;')]
+                if os.path.splitext(self.file_name)[1].lower() not in extensions:
+                    self.file_name += selected_filter[selected_filter.index('*') + 1:-1] if selected_filter else '.shp'
                 self.outputCleaned.setText(self.file_name)
             else:
                 self.outputCleaned.clear()
@@ -27,6 +27,7 @@ from qgis.gui import *
 from qgis.utils import *
 
 #import db_manager.db_plugins.postgis.connector as con
+import os
 import traceback
 
 # Initialize Qt resources from file resources.py
@@ -38,6 +39,8 @@ from road_network_cleaner_dialog import RoadNetworkCleanerDialog
 from sGraph.break_tools import *  # better give these a name to make it explicit to which module the methods belong
 from sGraph.merge_tools import *
 from sGraph.utilityFunctions import *
+from sGraph.profiling import RunProfile
+from sGraph.break_cache import BreakCache
 
 # Import the debug library - required for the cleaning class in separate thread
 # set is_debug to False in release version
@@ -192,29 +195,40 @@ class NetworkCleanerTool(QObject):
         crs = layer.dataProvider().crs()
         encoding = layer.dataProvider().encoding()
         geom_type = layer.dataProvider().geometryType()
+        profile = self.cleaning.profile
         # create the cleaning results layers
         try:
             # create clean layer
             if output_type == 'shp':
-                final = to_shp(path, ret[0][0], ret[0][1], crs, 'cleaned', encoding, geom_type)
+                with profile.phase('to_file') as record:
+                    final = to_file(path, ret[0][0], ret[0][1], crs, 'cleaned', encoding, geom_type)
+                    record['features'] += len(ret[0][0])
             elif output_type == 'memory':
-                final = to_shp(None, ret[0][0], ret[0][1], crs, path, encoding, geom_type)
+                with profile.phase('to_shp') as record:
+                    final = to_shp(None, ret[0][0], ret[0][1], crs, path, encoding, geom_type)
+                    record['features'] += len(ret[0][0])
             else:
-                final = to_dblayer(self.settings['dbname'], self.settings['user'], self.settings['host'],
-                                   self.settings['port'], self.settings['password'], self.settings['schema'],
-                                   self.settings['table_name'], ret[0][1], ret[0][0], crs)
+                with profile.phase('to_dblayer') as record:
+                    final = to_dblayer(self.settings['dbname'], self.settings['user'], self.settings['host'],
+                                       self.settings['port'], self.settings['password'], self.settings['schema'],
+                                       self.settings['table_name'], ret[0][1], ret[0][0], crs)
+                    record['features'] += len(ret[0][0])
             if final:
                 QgsMapLayerRegistry.instance().addMapLayer(final)
                 final.updateExtents()
             # create errors layer
             if self.settings['errors']:
-                errors = to_shp(None, ret[1][0], ret[1][1], crs, 'errors', encoding, geom_type)
+                with profile.phase('to_shp') as record:
+                    errors = to_shp(None, ret[1][0], ret[1][1], crs, 'errors', encoding, geom_type)
+                    record['features'] += len(ret[1][0])
                 if errors:
                     QgsMapLayerRegistry.instance().addMapLayer(errors)
                     errors.updateExtents()
             # create unlinks layer
             if self.settings['unlinks']:
-                unlinks = to_shp(None, ret[2][0], ret[2][1], crs, 'unlinks', encoding, 0)
+                with profile.phase('to_shp') as record:
+                    unlinks = to_shp(None, ret[2][0], ret[2][1], crs, 'unlinks', encoding, 0)
+                    record['features'] += len(ret[2][0])
                 if unlinks:
                     QgsMapLayerRegistry.instance().addMapLayer(unlinks)
                     unlinks.updateExtents()
@@ -228,6 +242,9 @@ class NetworkCleanerTool(QObject):
             self.cleaning.error.emit(e, traceback.format_exc())
             self.giveMessage('Something went wrong! See the message log for more information', QgsMessageBar.CRITICAL)
 
+        # timings of the run, as a json report
+        QgsMessageLog.logMessage('Cleaning profile: %s' % profile.to_json(), level=QgsMessageLog.INFO)
+
         # clean up the worker and thread
         #self.cleaning.deleteLater()
         self.thread.quit()
@@ -294,6 +311,8 @@ class NetworkCleanerTool(QObject):
             self.settings = settings
             self.iface = iface
             self.total =0
+            # shared by the break and merge tools, reported when the outputs are written
+            self.profile = RunProfile()
 
         def add_step(self,step):
             self.total += step
@@ -302,70 +321,94 @@ class NetworkCleanerTool(QObject):
         def run(self):
             if has_pydevd and is_debug:
                 pydevd.settrace('localhost', port=53100, stdoutToServer=True, stderrToServer=True, suspend=False)
-            ret = None
-            if self.settings:
-                try:
-                    # cleaning settings
-                    layer_name = self.settings['input']
-                    tolerance = self.settings['tolerance']
-                    # project settings
-                    layer = getLayerByName(layer_name)
+            # the phase is closed before the results are emitted and the profile reported
+            with self.profile.phase('clean.run'):
+                ret = None
+                if self.settings:
+                    try:
+                        # cleaning settings
+                        layer_name = self.settings['input']
+                        tolerance = self.settings['tolerance']
+                        # project settings
+                        layer = getLayerByName(layer_name)
 
-                    self.cl_progress.emit(2)
+                        self.cl_progress.emit(2)
 
-                    self.br = breakTool(layer, tolerance, None, self.settings['errors'], self.settings['unlinks'])
+                        self.br = breakTool(layer, tolerance, None, self.settings['errors'], self.settings['unlinks'],
+                                            profile=self.profile)
 
-                    if self.cl_killed is True or self.br.killed is True: return
+                        if self.cl_killed is True or self.br.killed is True: return
 
-                    self.br.add_edges()
+                        # with the cache on, a layer broken before with the same settings goes straight to the merge
+                        # (off by default: the key hashes the whole layer and the entry pickles the broken network)
+                        cache, entry = None, None
+                        if self.settings.get('cache'):
+                            cache = BreakCache(os.path.join(QgsApplication.qgisSettingsDirPath(),
+                                                            'road_network_cleaner_cache'))
+                            with self.profile.phase('cache_key'):
+                                cache_key = self.br.cache_key(cache)
+                            entry = cache.get(cache_key)
 
-                    if self.cl_killed is True or self.br.killed is True: return
+                        if entry is not None:
+                            broken_features = self.br.restore(entry)
+                        else:
+                            self.br.add_edges()
 
-                    self.cl_progress.emit(5)
-                    self.total = 5
-                    step = 40/ self.br.feat_count
-                    self.br.progress.connect(lambda incr=self.add_step(step): self.cl_progress.emit(incr))
+                            if self.cl_killed is True or self.br.killed is True: return
 
-                    broken_features = self.br.break_features()
+                            self.cl_progress.emit(5)
+                            self.total = 5
+                            step = 40/ self.br.feat_count
+                            self.br.progress.connect(lambda incr=self.add_step(step): self.cl_progress.emit(incr))
 
-                    if self.cl_killed is True or self.br.killed is True: return
+                            broken_features = self.br.break_features()
 
-                    self.cl_progress.emit(45)
+                            if self.cl_killed is True or self.br.killed is True: return
 
-                    self.mrg = mergeTool(broken_features, None, True)
+                            if self.settings['unlinks']:
+                                self.br.find_unlinks(broken_features)
 
-                    # TODO test
-                    try:
-                        step = 40/ len(self.mrg.con_1)
-                        self.mrg.progress.connect(lambda incr=self.add_step(step): self.cl_progress.emit(incr))
-                    except ZeroDivisionError:
-                        pass
+                            if cache is not None:
+                                cache.put(cache_key, self.br.cache_entry(broken_features))
+
+
+                        self.cl_progress.emit(45)
+
+                        self.mrg = mergeTool(broken_features, None, True, profile=self.profile)
+
+
+                        # TODO test
+                        try:
+                            step = 40/ len(self.mrg.con_1)
+                            self.mrg.progress.connect(lambda incr=self.add_step(step): self.cl_progress.emit(incr))
+                        except ZeroDivisionError:
+                            pass
 
-                    merged_features = self.mrg.merge()
+                        merged_features = self.mrg.merge()
 
-                    if self.cl_killed is True or self.mrg.killed is True: return
+                        if self.cl_killed is True or self.mrg.killed is True: return
 
-                    fields = self.br.layer_fields
+                        fields = self.br.layer_fields
 
-                    # prepare other output data
-                    ((errors_list, errors_fields), (unlinks_list, unlinks_fields)) = ((None, None), (None, None))
-                    if self.settings['errors']:
-                        self.br.updateErrors(self.mrg.errors_features)
-                        errors_list = [[k, [[k], [v[0]]], v[1]] for k, v in self.br.errors_features.items()]
-                        errors_fields = [QgsField('id_input', QVariant.Int), QgsField('errors', QVariant.String)]
+                        # prepare other output data
+                        ((errors_list, errors_fields), (unlinks_list, unlinks_fields)) = ((None, None), (None, None))
+                        if self.settings['errors']:
+                            self.br.updateErrors(self.mrg.errors_features)
+                            errors_list = [[k, [[k], [v[0]]], v[1]] for k, v in self.br.errors_features.items()]
+                            errors_fields = [QgsField('id_input', QVariant.Int), QgsField('errors', QVariant.String)]
 
-                    if self.settings['unlinks']:
-                        unlinks_list = self.br.unlinked_features
-                        unlinks_fields = [QgsField('id', QVariant.Int), QgsField('line_id1', QVariant.Int), QgsField('line_id2', QVariant.Int), QgsField('x', QVariant.Double), QgsField('y', QVariant.Double)]
+                        if self.settings['unlinks']:
+                            unlinks_list = self.br.unlinked_features
+                            unlinks_fields = [QgsField('id', QVariant.Int), QgsField('line_id1', QVariant.Int), QgsField('line_id2', QVariant.Int), QgsField('x', QVariant.Double), QgsField('y', QVariant.Double)]
 
-                    if is_debug: print "survived!"
-                    self.cl_progress.emit(100)
-                    # return cleaned data, errors and unlinks
-                    ret = ((merged_features, fields), (errors_list, errors_fields), (unlinks_list, unlinks_fields))
+                        if is_debug: print "survived!"
+                        self.cl_progress.emit(100)
+                        # return cleaned data, errors and unlinks
+                        ret = ((merged_features, fields), (errors_list, errors_fields), (unlinks_list, unlinks_fields))
 
-                except Exception, e:
-                    # forward the exception upstream
-                    self.error.emit(e, traceback.format_exc())
+                    except Exception, e:
+                        # forward the exception upstream
+                        self.error.emit(e, traceback.format_exc())
 
             self.finished.emit(ret)
 
@@ -0,0 +1,80 @@
+# general imports
+import os
+import zlib
+import hashlib
+import cPickle
+
+
+class BreakCache(object):
+    """On disk cache of the broken network, with least recently used eviction.
+
+    An entry holds what the break phase produced for a layer (broken features,
+    errors, unlinks and the edges they refer to) so a run on the same input
+    with the same break settings can go straight to the merge. Entries are
+    pickled and compressed in files named after their key; reading an entry
+    updates the modification time of its file and the least recently used
+    files are removed once all of them take more than max_size bytes.
+    """
+
+    # part of every key, to be changed when the layout of the entries changes
+    version = 1
+    extension = '.brk'
+
+    def __init__(self, cache_dir, max_size=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, *parts):
+        # e.g. the layer source, a hash of its content and the break settings
+        return hashlib.sha1(repr((self.version,) + parts)).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + self.extension)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as entry_file:
+                entry = cPickle.loads(zlib.decompress(entry_file.read()))
+        except IOError:
+            return None
+        except (zlib.error, cPickle.UnpicklingError, EOFError, ValueError):
+            # written by an interrupted run
+            os.remove(path)
+            return None
+        os.utime(path, None)
+        return entry
+
+    def put(self, key, entry):
+        path = self.path(key)
+        # written aside and renamed so an interrupted run leaves no partial entry
+        with open(path + '.tmp', 'wb') as entry_file:
+            entry_file.write(zlib.compress(cPickle.dumps(entry, cPickle.HIGHEST_PROTOCOL), 1))
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(path + '.tmp', path)
+        self.evict()
+
+    def size(self):
+        return sum([size for mtime, size, path in self.entries()])
+
+    def entries(self):
+        # (modification time, size, path) of the entries, least recently used first
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.extension):
+                path = os.path.join(self.cache_dir, name)
+                entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+        entries.sort()
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total = sum([size for mtime, size, path in entries])
+        # the entry just written is kept even if it is larger than max_size
+        while total > self.max_size and len(entries) > 1:
+            mtime, size, path = entries.pop(0)
+            os.remove(path)
+            total -= size
@@ -1,15 +1,63 @@
 
 # general imports
-from qgis.core import QgsFeature, QgsGeometry, QgsSpatialIndex, QgsPoint, QgsVectorFileWriter, QgsField
+import multiprocessing
+from array import array
+from qgis.core import QgsFeature, QgsGeometry, QgsSpatialIndex, QgsPoint, QgsVectorFileWriter, QgsField, QgsRectangle
 from PyQt4.QtCore import QObject, pyqtSignal, QVariant
 
 
 # plugin module imports
 try:
     from utilityFunctions import *
+    from edge_store import EdgeStore, EdgeCache
+    from node_index import VertexIndex, polylines_touch_between_vertices, repeated_vertices, self_crosses, \
+        proper_crossings
+    from tile_tools import make_tiles, union_extent
+    from spatial_index import PackedRTree
+    from profiling import RunProfile, profiled
 except ImportError:
     pass
 
+class edgeFacts(object):
+    # what the intersections with the other edges revealed about an edge
+    # breakages are the indices of the vertices where the edge must break
+    __slots__ = ['breakages', 'is_orphan', 'must_break', 'has_overlaps', 'is_duplicate']
+
+    def __init__(self):
+        self.breakages = set()
+        self.is_orphan = True
+        self.must_break = False
+        self.has_overlaps = False
+        self.is_duplicate = False
+
+    def add_breakages(self, break_indices, overlap_indices):
+        if break_indices:
+            self.breakages.update(break_indices)
+            self.is_orphan = False
+            self.must_break = True
+        if overlap_indices:
+            self.breakages.update(overlap_indices)
+            self.is_orphan = False
+            self.has_overlaps = True
+
+    def add_vertex_breakages(self, indices):
+        self.breakages.update(indices)
+        self.is_orphan = False
+        self.must_break = True
+
+    def to_tuple(self):
+        # picklable form
+        return self.breakages, self.is_orphan, self.must_break, self.has_overlaps, self.is_duplicate
+
+    def update(self, indices, is_orphan, must_break, has_overlaps, is_duplicate):
+        # adds the facts found about the same edge in another tile
+        self.breakages.update(indices)
+        self.is_orphan = self.is_orphan and is_orphan
+        self.must_break = self.must_break or must_break
+        self.has_overlaps = self.has_overlaps or has_overlaps
+        self.is_duplicate = self.is_duplicate or is_duplicate
+
+
 class breakTool(QObject):
 
     finished = pyqtSignal(object)
@@ -18,12 +66,24 @@ class breakTool(QObject):
     warning = pyqtSignal(str)
     killed = pyqtSignal(bool)
 
-    def __init__(self,layer, tolerance, uid, errors, unlinks):
+    # edges whose vertices, positions and geometry are kept from one pair to the next
+    edge_cache_size = 50000
+
+    def __init__(self,layer, tolerance, uid, errors, unlinks, snap_mode='truncate', break_engine='geos', workers=1,
+                 spill_dir=None, index_type='packed', profile=None):
         QObject.__init__(self)
 
+        # layer is None when the edges are loaded directly in the store (worker processes)
         self.layer = layer
-        self.feat_count = self.layer.featureCount()
+        self.feat_count = self.layer.featureCount() if layer else 0
         self.tolerance = tolerance
+        self.snap_mode = snap_mode
+        # 'geos': intersect every pair of candidates, 'vertex': find breaks from the shared vertices
+        # and only intersect the pairs that meet between vertices
+        self.break_engine = break_engine
+        self.vertex_index = None
+        # number of processes of the break phase, with more than one the layer is split in tiles
+        self.workers = workers
         self.uid = uid
 
         self.errors = errors
@@ -34,22 +94,35 @@ class breakTool(QObject):
         self.ml_keys = {}
         self.br_keys = {}
 
-        self.features = []
-        self.attributes = {}
-        self.geometries = {}
-        self.geometries_wkt = {}
-        self.geometries_vertices = {}
-        # create spatial index object
-        self.spIndex = QgsSpatialIndex()
-        self.layer_fields = [QgsField(i.name(), i.type()) for i in self.layer.dataProvider().fields()]
+        # coordinates and attributes of the edges, geometries are built from the store when needed
+        # streaming mode (spill_dir): the store is kept on disk
+        self.store = EdgeStore(spill_dir)
+        self.geometries = EdgeCache(self.edge_cache_size)
+        # vertices of the edges being broken and {vertex: index of its first occurrence}, read once per edge
+        # and kept until its own pass for the edge_cache_size edges used last
+        self.polylines = EdgeCache(self.edge_cache_size)
+        self.positions = EdgeCache(self.edge_cache_size)
+        # edges read but not yet snapped and added to the store
+        self.chunk_coords = array('d')
+        self.chunk_ends = array('l')
+        self.chunk_refs = array('l')
+        # spatial index, built in bulk once the edges are in the store
+        # 'packed': STR packed PackedRTree, 'qgis': QgsSpatialIndex filled one edge at a time
+        self.index_type = index_type
+        self.spIndex = None
+        self.layer_fields = [QgsField(i.name(), i.type()) for i in self.layer.dataProvider().fields()] if layer else []
+        # timings of the phases, counts of the geos calls and of the index queries
+        self.profile = profile if profile is not None else RunProfile()
+
+    @profiled('add_edges', features=lambda self, result: len(self.store))
+    def add_edges(self, chunk_size=None, request=None):
+        # the edges are snapped and added to the store every chunk_size features
+        # (all at once without a chunk_size), in streaming mode only one chunk is held in memory
+        # request (QgsFeatureRequest) limits the features read, e.g. to the edited part of the layer
 
-    def add_edges(self):
-
-        new_key_count = 0
         f_count = 1
 
-        for f in self.layer.getFeatures():
-
+        for f in (self.layer.getFeatures(request) if request else self.layer.getFeatures()):
             self.progress.emit(3 * f_count / self.feat_count)
             f_count += 1
 
@@ -65,26 +138,9 @@ class breakTool(QObject):
             if geom_type == 5:
                 if self.errors:
                     self.errors_features[f.id()] = ('multipart', f.geometry().exportToWkt())
+                attr_ref = self.store.add_attributes(f.attributes())
                 for multipart in f.geometry().asGeometryCollection():
-                    new_key_count += 1
-                    attr = f.attributes()
-                    new_feat = QgsFeature()
-                    new_feat.setAttributes(attr)
-                    new_feat.setFeatureId(new_key_count)
-                    if self.tolerance:
-                        snapped_wkt = make_snapped_wkt(multipart.exportToWkt(), self.tolerance)
-                    else:
-                        snapped_wkt = multipart.exportToWkt()
-                    snapped_geom = QgsGeometry.fromWkt(snapped_wkt)
-                    new_feat.setGeometry(snapped_geom)
-                    self.features.append(new_feat)
-                    self.attributes[new_key_count] = attr
-                    self.geometries[new_key_count] = new_feat.geometryAndOwnership()
-                    self.geometries_wkt[new_key_count] = snapped_wkt
-                    self.geometries_vertices[new_key_count] = [vertex for vertex in vertices_from_wkt_2(snapped_wkt)]
-                    # insert features to index
-                    self.spIndex.insertFeature(new_feat)
-                    self.ml_keys[new_key_count] = f.id()
+                    self.add_edge(multipart, attr_ref, f.id())
             elif geom_type == 1:
                 if self.errors:
                     self.errors_features[f.id()] = ('point', QgsGeometry().exportToWkt())
@@ -92,175 +148,265 @@ class breakTool(QObject):
                 if self.errors:
                     self.errors_features[f.id()] = ('invalid', QgsGeometry().exportToWkt())
             elif geom_type == 2:
-                attr = f.attributes()
-                if self.tolerance:
-                    snapped_wkt = make_snapped_wkt(f.geometry().exportToWkt(), self.tolerance)
-                else:
-                    snapped_wkt = f.geometry().exportToWkt()
-                snapped_geom = QgsGeometry.fromWkt(snapped_wkt)
-                f.setGeometry(snapped_geom)
-                new_key_count += 1
-                f.setFeatureId(new_key_count)
-                self.features.append(f)
-                self.attributes[f.id()] = attr
-                self.geometries[f.id()] = f.geometryAndOwnership()
-                self.geometries_wkt[f.id()] = snapped_wkt
-                self.geometries_vertices[f.id()] = [vertex for vertex in vertices_from_wkt_2(snapped_wkt)]
+                attr_ref = self.store.add_attributes(f.attributes())
+                self.add_edge(f.geometry(), attr_ref, f.id())
+
+            if chunk_size and f_count % chunk_size == 0:
+                self.flush_edges()
+
+        self.flush_edges()
+        self.index_edges()
+
+    def flush_edges(self):
+        # snap the coordinates of the chunk at once and move them to the store
+        if self.tolerance:
+            self.chunk_coords = snap_coords(self.chunk_coords, self.tolerance, self.snap_mode)
+        self.store.add_coords(self.chunk_coords, self.chunk_ends, self.chunk_refs)
+        self.chunk_coords = array('d')
+        self.chunk_ends = array('l')
+        self.chunk_refs = array('l')
+
+    def candidates(self, bbox):
+        # ids of the edges whose bounding box intersects bbox (xmin, ymin, xmax, ymax)
+        self.profile.count('index_queries')
+        if self.index_type == 'qgis':
+            return self.spIndex.intersects(QgsRectangle(*bbox))
+        return self.spIndex.intersects(bbox)
+
+    def geometry(self, fid):
+        return self.geometries.get(fid, self.make_geometry)
+
+    def make_geometry(self, fid):
+        points = self.polylines.peek(fid) or self.store.vertices(fid)
+        return QgsGeometry.fromPolyline([QgsPoint(x, y) for x, y in points])
+
+    def polyline(self, fid):
+        return self.polylines.get(fid, self.store.vertices)
+
+    def vertex_positions(self, fid):
+        return self.positions.get(fid, self.make_positions)
+
+    def make_positions(self, fid):
+        positions = {}
+        for index, vertex in enumerate(self.polyline(fid)):
+            positions.setdefault(vertex, index)
+        return positions
+
+    def drop_polyline(self, fid):
+        # once an edge is broken all its pairs have been evaluated
+        self.polylines.drop(fid)
+        self.positions.drop(fid)
+        self.geometries.drop(fid)
+
+    def index_edges(self):
+        if self.index_type == 'qgis':
+            self.spIndex = QgsSpatialIndex()
+            for fid in self.store.ids():
                 # insert features to index
-                self.spIndex.insertFeature(f)
-                self.ml_keys[new_key_count] = f.id()
-
+                index_feat = QgsFeature(fid)
+                index_feat.setGeometry(self.make_geometry(fid))
+                self.spIndex.insertFeature(index_feat)
+        else:
+            self.spIndex = PackedRTree(self.store.ids(), (self.store.bbox(fid) for fid in self.store.ids()))
+
+        if self.break_engine == 'vertex':
+            self.vertex_index = VertexIndex(self.store)
+
+    def add_edge(self, geom, attr_ref, original_id):
+        for point in geom.asPolyline():
+            self.chunk_coords.append(point.x())
+            self.chunk_coords.append(point.y())
+        self.chunk_ends.append(len(self.chunk_coords) // 2)
+        self.chunk_refs.append(attr_ref)
+        fid = len(self.store) + len(self.chunk_ends)
+        self.ml_keys[fid] = original_id
+        return fid
+
+    @profiled('break_features', features=lambda self, result: len(result))
     def break_features(self):
 
         broken_features = []
         f_count = 1
+        # facts of the edges that still have pairs to be evaluated
+        if self.workers > 1:
+            facts = self.relate_tiles()
+        else:
+            facts = {}
 
-        for fid in self.geometries.keys():
+        # timed once around the loop, the edges are too many to time each one
+        with self.profile.phase('break_loop') as record:
+            for fid in self.store.ids():
 
-            if self.killed is True:
-                break
+                if self.killed is True:
+                    break
 
-            f_geom = self.geometries[fid]
-            f_attrs = self.attributes[fid]
+                f_attrs = self.store.attributes(fid)
 
-            # intersecting lines
-            gids = self.spIndex.intersects(f_geom.boundingBox())
+                if self.workers <= 1:
+                    # intersecting lines
+                    gids = self.candidates(self.store.bbox(fid))
 
-            self.progress.emit((45 * f_count / self.feat_count) + 5)
-            f_count += 1
+                    self.progress.emit((45 * f_count / self.feat_count) + 5)
+                    f_count += 1
 
-            f_errors, vertices = self.find_breakages(fid, gids)
+                    # every pair is evaluated once, from its lower id, so all pairs of fid are known after this
+                    self.relate_edges(fid, sorted([gid for gid in gids if gid > fid]), facts)
 
-            if self.errors and f_errors:
-                original_id = self.ml_keys[fid]
-                try:
-                    updated_errors = self.errors_features[original_id][0] + f_errors
-                    self.errors_features[original_id] = (updated_errors, self.errors_features[original_id][1])
-                except KeyError:
-                    self.errors_features[original_id] = (f_errors, self.geometries[fid].exportToWkt())
-
-            if f_errors is None:
-                vertices = [0, len(f_geom.asPolyline()) - 1 ]
-
-            if f_errors in ['breakage, overlap', 'breakage', 'overlap', None]:
-                for ind, index in enumerate(vertices):
-                    if ind != len(vertices) - 1:
-                        points = [self.geometries_vertices[fid][i] for i in range(index, vertices[ind + 1] + 1)]
-                        p = ''
-                        for point in points:
-                            p += point[0] + ' ' + point[1] + ', '
-                        wkt = 'LINESTRING(' + p[:-2] + ')'
-                        self.feat_count += 1
-                        new_fid = self.feat_count
-                        new_feat = [new_fid, f_attrs, wkt]
-                        broken_features.append(new_feat)
-                        self.br_keys[new_fid] = fid
+                f_errors, vertices = self.find_breakages(fid, self.get_facts(facts, fid))
+                del facts[fid]
+                self.drop_polyline(fid)
+
+                if self.errors and f_errors:
+                    original_id = self.ml_keys[fid]
+                    try:
+                        updated_errors = self.errors_features[original_id][0] + f_errors
+                        self.errors_features[original_id] = (updated_errors, self.errors_features[original_id][1])
+                    except KeyError:
+                        self.errors_features[original_id] = (f_errors, self.make_geometry(fid).exportToWkt())
+
+                if f_errors is None:
+                    vertices = [0, self.store.vertex_count(fid) - 1]
+
+                if f_errors in ['breakage, overlap', 'breakage', 'overlap', None]:
+                    for ind, index in enumerate(vertices):
+                        if ind != len(vertices) - 1:
+                            wkt = self.store.wkt(fid, index, vertices[ind + 1])
+                            self.feat_count += 1
+                            new_fid = self.feat_count
+                            new_feat = [new_fid, f_attrs, wkt]
+                            broken_features.append(new_feat)
+                            self.br_keys[new_fid] = fid
+            record['features'] += len(self.store)
 
         return broken_features
 
+    def cache_key(self, cache):
+        # the layer, its content and the settings the break phase depends on
+        return cache.key(self.layer.source(), layer_content_hash(self.layer), self.tolerance, self.snap_mode,
+                         self.break_engine, self.errors, self.unlinks)
+
+    def cache_entry(self, broken_features):
+        # what a later run needs to merge without breaking again, errors need the edges for updateErrors
+        return {'broken_features': broken_features, 'errors_features': self.errors_features,
+                'unlinked_features': self.unlinked_features, 'br_keys': self.br_keys, 'ml_keys': self.ml_keys,
+                'feat_count': self.feat_count, 'store': self.store.dump()}
+
+    def restore(self, entry):
+        # state of the break phase from a cache entry, returns the broken features
+        self.errors_features = entry['errors_features']
+        self.unlinked_features = entry['unlinked_features']
+        self.unlinks_count = len(self.unlinked_features)
+        self.br_keys = entry['br_keys']
+        self.ml_keys = entry['ml_keys']
+        self.feat_count = entry['feat_count']
+        self.store.load(entry['store'])
+        return entry['broken_features']
+
     def kill(self):
         self.br_killed = True
+        self.close()
+
+    def close(self):
+        # removes the files of the store in streaming mode, once the edges are no longer read
+        self.store.close()
+
+    def get_facts(self, facts, fid):
+        try:
+            return facts[fid]
+        except KeyError:
+            facts[fid] = edgeFacts()
+            return facts[fid]
+
+    def relate_tiles(self):
+        # evaluates the pairs in a pool of processes, each one working on a tile of the layer
+        # a pair is evaluated by the tile owning its lower id, the tile receives every edge whose
+        # bounding box intersects the extent of the edges it owns so it finds all their candidates
+        bboxes = dict((fid, self.store.bbox(fid)) for fid in self.store.ids())
+        tiles = make_tiles(bboxes, 4 * self.workers)
+
+        def tile_jobs():
+            for owned in tiles:
+                extent = union_extent([bboxes[fid] for fid in owned])
+                context = sorted(self.candidates(extent))
+                yield (owned, [(eid, self.store.vertices(eid)) for eid in context], self.break_engine,
+                       self.index_type)
+
+        facts = {}
+        pool = multiprocessing.Pool(self.workers)
+        for t_count, (tile_facts, tile_counters) in enumerate(pool.imap_unordered(break_tile, tile_jobs()), start=1):
+            if self.killed is True:
+                pool.terminate()
+                break
+            self.progress.emit((45 * t_count / len(tiles)) + 5)
+            for fid, f_facts in tile_facts.items():
+                self.get_facts(facts, fid).update(*f_facts)
+            self.profile.add_counters(tile_counters)
+        else:
+            pool.close()
+        pool.join()
+        return facts
 
-    def find_breakages(self, fid, gids):
-
-        f_geom = self.geometries[fid]
+    def relate_edges(self, fid, gids, facts):
+        # evaluates each pair (fid, gid) once with a single intersection and records the result for both edges
+        # gid > fid: as before, the edge with the higher id is the duplicate
+        f_geom = self.geometry(fid)
+        f_facts = self.get_facts(facts, fid)
 
-        # errors checks
-        must_break = False
-        is_closed = False
-        if f_geom.asPolyline()[0] == f_geom.asPolyline()[-1]:
-            is_closed = True
-        is_orphan = True
-        is_duplicate = False
-        has_overlaps = False
-
-        # get breaking points
-        breakages = []
-
-        # is self intersecting
-        is_self_intersersecting = False
-        for i in f_geom.asPolyline():
-            if f_geom.asPolyline().count(i) > 1:
-                point = QgsGeometry().fromPoint(QgsPoint(i[0], i[1]))
-                breakages.append(point)
-                is_self_intersersecting = True
-                must_break = True
+        if self.break_engine == 'vertex':
+            f_points = self.polyline(fid)
+            shared = self.vertex_index.shared_vertices(fid, f_points)
 
         for gid in gids:
 
-            g_geom = self.geometries[gid]
-
-            if gid < fid:
-                # duplicate geometry
-                if f_geom.isGeosEqual(g_geom):
-                    is_duplicate = True
-
-                if self.unlinks:
-                    if f_geom.crosses(g_geom):
-                        crossing_point = f_geom.intersection(g_geom)
-                        if crossing_point.wkbType() == 1:
-                            self.unlinks_count += 1
-                            unlinks_attrs = [[self.unlinks_count], [gid], [fid], [crossing_point.asPoint()[0]],
-                                             [crossing_point.asPoint()[1]]]
-                            self.unlinked_features.append([self.unlinks_count, unlinks_attrs, crossing_point.exportToWkt()])
-                        elif crossing_point.wkbType() == 4:
-                            for cr_point in crossing_point.asGeometryCollection():
-                                self.unlinks_count += 1
-                                unlinks_attrs = [[self.unlinks_count], [gid], [fid], [cr_point.asPoint()[0]],
-                                                 [cr_point.asPoint()[1]]]
-                                self.unlinked_features.append([self.unlinks_count, unlinks_attrs, cr_point.exportToWkt()])
-
-            if is_duplicate is False:
-                intersection = f_geom.intersection(g_geom)
-                # intersecting geometries at point
-                if intersection.wkbType() == 1 and point_is_vertex(intersection, f_geom):
-                    breakages.append(intersection)
-                    is_orphan = False
-                    must_break = True
-
-                # intersecting geometries at multiple points
-                elif intersection.wkbType() == 4:
-                    for point in intersection.asGeometryCollection():
-                        if point_is_vertex(point, f_geom):
-                            breakages.append(point)
-                            is_orphan = False
-                            must_break = True
-
-                # overalpping geometries
-                elif intersection.wkbType() == 2 and intersection.length() != f_geom.length():
-                    point1 = QgsGeometry.fromPoint(QgsPoint(intersection.asPolyline()[0]))
-                    point2 = QgsGeometry.fromPoint(QgsPoint(intersection.asPolyline()[-1]))
-                    if point_is_vertex(point1, f_geom):
-                        breakages.append(point1)
-                        is_orphan = False
-                        must_break = True
-                    if point_is_vertex(point2, f_geom):
-                        breakages.append(point2)
-                        is_orphan = False
-                        must_break = True
-
-                # overalpping multi-geometries
-                # every feature overlaps with itself as a multilinestring
-                elif intersection.wkbType() == 5 and intersection.length() != f_geom.length():
-                    point1 = QgsGeometry.fromPoint(QgsPoint(intersection.asGeometryCollection()[0].asPolyline()[0]))
-                    point2 = QgsGeometry.fromPoint(QgsPoint(intersection.asGeometryCollection()[-1].asPolyline()[-1]))
-                    if point_is_vertex(point1, f_geom):
-                        is_orphan = False
-                        has_overlaps = True
-                        breakages.append(point1)
-                    if point_is_vertex(point2, f_geom):
-                        is_orphan = False
-                        has_overlaps = True
-                        breakages.append(point2)
-
-        if is_duplicate is True:
+            g_facts = self.get_facts(facts, gid)
+
+            if self.break_engine == 'vertex':
+                g_points = self.polyline(gid)
+                if not polylines_touch_between_vertices(f_points, g_points):
+                    # the lines only meet at shared vertices: no duplicate, no overlap and
+                    # every shared vertex is a breaking point
+                    if gid in shared:
+                        f_facts.add_vertex_breakages(shared[gid])
+                        g_positions = self.vertex_positions(gid)
+                        g_facts.add_vertex_breakages([g_positions[f_points[i]] for i in shared[gid]])
+                    continue
+
+            g_geom = self.geometry(gid)
+            intersection = f_geom.intersection(g_geom)
+            self.profile.count('geos_calls')
+
+            # duplicate geometry: the intersection is as long as both lines
+            if intersection.wkbType() in [2, 5] and is_same_length(intersection, f_geom) and is_same_length(intersection, g_geom):
+                self.profile.count('geos_calls')
+                if g_geom.isGeosEqual(f_geom):
+                    g_facts.is_duplicate = True
+                    continue
+
+            f_facts.add_breakages(*self.intersection_breakages(fid, f_geom, intersection))
+            g_facts.add_breakages(*self.intersection_breakages(gid, g_geom, intersection))
+
+    def find_breakages(self, fid, f_facts):
+
+        # errors checks
+        is_closed = self.store.is_closed(fid)
+        must_break = f_facts.must_break
+        is_orphan = f_facts.is_orphan
+        has_overlaps = f_facts.has_overlaps
+
+        # is self intersecting: repeated vertices (where it breaks) or segments crossing between vertices
+        f_points = self.polyline(fid)
+        self_breakages = repeated_vertices(f_points)
+        is_self_intersersecting = bool(self_breakages) or self_crosses(f_points)
+        if is_self_intersersecting:
+            must_break = True
+
+        if f_facts.is_duplicate is True:
             return 'duplicate', []
         else:
             # add first and last vertex
-            vertices = set([vertex for vertex in find_vertex_index(breakages, f_geom)])
-            vertices = list(vertices) + [0] + [len(f_geom.asPolyline()) - 1]
-            vertices = list(set(vertices))
-            vertices.sort()
+            vertices = f_facts.breakages | set(self_breakages)
+            vertices.update([0, len(f_points) - 1])
+            vertices = sorted(vertices)
 
             if is_orphan:
                 if is_closed is True:
@@ -287,6 +433,50 @@ class breakTool(QObject):
             else:
                 return None, []
 
+    def intersection_breakages(self, fid, f_geom, intersection):
+        # returns the indices of the vertices of fid where it must break because of the intersection
+        # as (breaking vertices, vertices where the lines start or stop overlapping)
+        positions = self.vertex_positions(fid)
+        points = []
+        overlap_points = []
+        # intersecting geometries at point
+        if intersection.wkbType() == 1:
+            points = [intersection.asPoint()]
+
+        # intersecting geometries at multiple points
+        elif intersection.wkbType() == 4:
+            points = [point.asPoint() for point in intersection.asGeometryCollection()]
+
+        # overalpping geometries
+        elif intersection.wkbType() == 2 and intersection.length() != f_geom.length():
+            polyline = intersection.asPolyline()
+            points = [polyline[0], polyline[-1]]
+
+        # overalpping multi-geometries
+        # every feature overlaps with itself as a multilinestring
+        elif intersection.wkbType() == 5 and intersection.length() != f_geom.length():
+            parts = intersection.asGeometryCollection()
+            overlap_points = [parts[0].asPolyline()[0], parts[-1].asPolyline()[-1]]
+
+        break_indices = [positions[(p.x(), p.y())] for p in points if (p.x(), p.y()) in positions]
+        overlap_indices = [positions[(p.x(), p.y())] for p in overlap_points if (p.x(), p.y()) in positions]
+        return break_indices, overlap_indices
+
+    @profiled('find_unlinks', features=lambda self, result: len(result))
+    def find_unlinks(self, broken_features):
+        # separate pass over the broken network, to be run only when the unlinks are needed:
+        # the lines crossing without a common vertex (bridges, tunnels), found with a sweep of the
+        # segments of the edges kept; an unlink refers to the two edges, the lower id first
+        eids = sorted(set([self.br_keys[new_fid] for new_fid, attrs, wkt in broken_features]))
+        crossings = proper_crossings([(eid, self.store.vertices(eid)) for eid in eids])
+        crossings.sort()
+        for fid, gid, x, y in crossings:
+            self.unlinks_count += 1
+            unlinks_attrs = [[self.unlinks_count], [fid], [gid], [x], [y]]
+            self.unlinked_features.append([self.unlinks_count, unlinks_attrs,
+                                           QgsGeometry.fromPoint(QgsPoint(x, y)).exportToWkt()])
+        return crossings
+
     def updateErrors(self, errors_dict):
 
         for k, v in errors_dict.items():
@@ -307,4 +497,26 @@ class breakTool(QObject):
                         updated_errors += ', continuous line'
                     self.errors_features[original_id] = (updated_errors, self.errors_features[original_id][1])
                 except KeyError:
-                    self.errors_features[original_id] = ('continuous line', self.geometries[original_id].exportToWkt())
+                    self.errors_features[original_id] = ('continuous line', self.geometry(original_id).exportToWkt())
+
+
+def break_tile(tile):
+    # runs in a worker process: evaluates the pairs of the edges owned by a tile
+    # the edges are given in ascending id order so the local ids keep the order of the global ones
+    owned, context, break_engine, index_type = tile
+    br = breakTool(None, None, None, False, False, break_engine=break_engine, index_type=index_type)
+    global_ids = []
+    for eid, points in context:
+        global_ids.append(eid)
+        br.store.add_edge(points, 0)
+    br.index_edges()
+    local_ids = dict((eid, local_id) for local_id, eid in enumerate(global_ids, start=1))
+
+    facts = {}
+    for eid in owned:
+        fid = local_ids[eid]
+        gids = br.candidates(br.store.bbox(fid))
+        br.relate_edges(fid, sorted([gid for gid in gids if gid > fid]), facts)
+
+    tile_facts = dict((global_ids[fid - 1], f_facts.to_tuple()) for fid, f_facts in facts.items())
+    return tile_facts, br.profile.counters
@@ -0,0 +1,92 @@
+# general imports
+
+
+def find_chains(all_con):
+    # all_con: {edge: [edges connected to it through a degree 2 node]}
+    # returns the chains of edges to be merged, every edge of all_con is in exactly one chain
+    # each edge is visited once, so this runs in O(edges) whatever the length of the chains
+    visited = set()
+    chains = []
+    # open chains are walked from one of their two ends (edges with one connection)
+    for edge in sorted(all_con.keys()):
+        if edge not in visited and len(all_con[edge]) == 1:
+            chains.append(walk_chain(edge, all_con, visited))
+    # the edges left belong to closed rings, which have no end to start from
+    for edge in sorted(all_con.keys()):
+        if edge not in visited:
+            chains.append(walk_chain(edge, all_con, visited))
+    return chains
+
+
+def walk_chain(edge, all_con, visited):
+    chain = [edge]
+    visited.add(edge)
+    while True:
+        next_edge = None
+        for con_edge in all_con[chain[-1]]:
+            if con_edge not in visited:
+                next_edge = con_edge
+                break
+        if next_edge is None:
+            return chain
+        chain.append(next_edge)
+        visited.add(next_edge)
+
+
+def stitch_chain(polylines):
+    # polylines: the vertex lists of the edges of a chain, in chain order
+    # consecutive edges share an end, the merged polyline is their concatenation with the
+    # edges flipped where needed, returns None when the order of the ends is ambiguous
+    merged = list(polylines[0])
+    if len(polylines) == 1:
+        return merged
+    second = polylines[1]
+    first_shared = merged[0] in (second[0], second[-1])
+    last_shared = merged[-1] in (second[0], second[-1])
+    if first_shared and last_shared and merged[0] != merged[-1]:
+        # the first two edges form a ring
+        if len(polylines) > 2:
+            return None
+    elif first_shared:
+        merged.reverse()
+    elif not last_shared:
+        return None
+    for polyline in polylines[1:]:
+        if polyline[0] == merged[-1]:
+            merged.extend(polyline[1:])
+        elif polyline[-1] == merged[-1]:
+            merged.extend(polyline[-2::-1])
+        else:
+            return None
+    return merged
+
+
+def connected_components(ends):
+    # ends: the (end, end) pairs of the edges, any hashable vertices
+    # returns the component number of every edge, edges joined through shared ends have the
+    # same number; union find with union by size and path halving, in about O(edges)
+    ids = {}
+    for edge_ends in ends:
+        for end in edge_ends:
+            if end not in ids:
+                ids[end] = len(ids)
+    parent = range(len(ids))
+    size = [1] * len(ids)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for end0, end1 in ends:
+        root0, root1 = find(ids[end0]), find(ids[end1])
+        if root0 != root1:
+            if size[root0] < size[root1]:
+                root0, root1 = root1, root0
+            parent[root1] = root0
+            size[root0] += size[root1]
+
+    # numbered in the order of the edges
+    numbers = {}
+    return [numbers.setdefault(find(ids[end0]), len(numbers)) for end0, end1 in ends]
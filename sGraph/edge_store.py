@@ -0,0 +1,280 @@
+# general imports
+import os
+import mmap
+import cPickle
+import tempfile
+from array import array
+from collections import OrderedDict
+
+
+class EdgeStore(object):
+    """Compact storage of the edges of a network.
+
+    The coordinates of all edges are kept in one contiguous float64 buffer
+    (x0, y0, x1, y1, ...) and an offsets array gives, per edge, the position
+    of its first vertex in that buffer. Edge ids are 1-based and handed out
+    in insertion order: edge e spans the vertices offsets[e - 1] to
+    offsets[e] - 1. Attributes are stored once per input row and every edge
+    keeps an integer reference to its row, so the parts of a multipart
+    feature share the same attribute list.
+
+    With a spill_dir the arrays and the attribute rows are written to files
+    in that directory as they grow and read back through memory maps, so the
+    memory used by the store does not depend on the size of the network.
+    The files have unique names and are removed by close().
+    """
+
+    def __init__(self, spill_dir=None):
+        self.spill_dir = spill_dir
+        if spill_dir is None:
+            self.coords = array('d')
+            self.offsets = array('l', [0])
+            self.attr_refs = array('l')
+            self.attr_rows = []
+        else:
+            self.coords = SpilledArray('d', spill_dir, 'coords')
+            self.offsets = SpilledArray('l', spill_dir, 'offsets')
+            self.offsets.append(0)
+            self.attr_refs = SpilledArray('l', spill_dir, 'attr_refs')
+            self.attr_rows = SpilledRows(spill_dir)
+
+    def __len__(self):
+        return len(self.attr_refs)
+
+    def ids(self):
+        return xrange(1, len(self.attr_refs) + 1)
+
+    def add_attributes(self, attrs):
+        self.attr_rows.append(attrs)
+        return len(self.attr_rows) - 1
+
+    def add_edge(self, points, attr_ref):
+        # points is a sequence of (x, y) pairs
+        for x, y in points:
+            self.coords.append(x)
+            self.coords.append(y)
+        self.offsets.append(len(self.coords) // 2)
+        self.attr_refs.append(attr_ref)
+        return len(self.attr_refs)
+
+    def add_coords(self, coords, ends, attr_refs):
+        # adds a batch of edges given as a flat array of coordinates, the vertex count at
+        # the end of each edge (relative to the batch) and the attribute reference of each edge
+        start = len(self.coords) // 2
+        self.coords.extend(coords)
+        self.offsets.extend([start + end for end in ends])
+        self.attr_refs.extend(attr_refs)
+
+    def attributes(self, eid):
+        return self.attr_rows[self.attr_refs[eid - 1]]
+
+    def attributes_ref(self, eid):
+        return self.attr_refs[eid - 1]
+
+    def vertex_count(self, eid):
+        return self.offsets[eid] - self.offsets[eid - 1]
+
+    def vertex(self, eid, index):
+        if index < 0:
+            index += self.vertex_count(eid)
+        pos = 2 * (self.offsets[eid - 1] + index)
+        return self.coords[pos], self.coords[pos + 1]
+
+    def first_vertex(self, eid):
+        pos = 2 * self.offsets[eid - 1]
+        return self.coords[pos], self.coords[pos + 1]
+
+    def last_vertex(self, eid):
+        pos = 2 * self.offsets[eid] - 2
+        return self.coords[pos], self.coords[pos + 1]
+
+    def vertices(self, eid, start=0, end=None):
+        # vertices from start to end (both included)
+        first = self.offsets[eid - 1]
+        if end is None:
+            end = self.offsets[eid] - first - 1
+        xy = self.coords[2 * (first + start): 2 * (first + end + 1)]
+        return zip(xy[0::2], xy[1::2])
+
+    def is_closed(self, eid):
+        return self.first_vertex(eid) == self.last_vertex(eid)
+
+    def bbox(self, eid):
+        xy = self.coords[2 * self.offsets[eid - 1]: 2 * self.offsets[eid]]
+        xs, ys = xy[0::2], xy[1::2]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def wkt(self, eid, start=0, end=None):
+        return coords_to_wkt(self.vertices(eid, start, end))
+
+    def dump(self):
+        # the arrays as strings and the attribute rows, for an empty store to load
+        return (self.coords[:].tostring(), self.offsets[1:].tostring(), self.attr_refs[:].tostring(),
+                [self.attr_rows[i] for i in xrange(len(self.attr_rows))])
+
+    def load(self, dumped):
+        coords, offsets, attr_refs, attr_rows = dumped
+        self.coords.extend(array('d', coords))
+        self.offsets.extend(array('l', offsets))
+        self.attr_refs.extend(array('l', attr_refs))
+        for attrs in attr_rows:
+            self.attr_rows.append(attrs)
+
+    def close(self):
+        # removes the files of a spilled store, it can not be read after
+        if self.spill_dir is not None:
+            for spilled in (self.coords, self.offsets, self.attr_refs, self.attr_rows):
+                spilled.close()
+
+
+class SpilledArray(object):
+    """Append only array of one typecode kept in a file.
+
+    Appended values are buffered and written to the end of the file when the
+    buffer is full. Reads of written values go through a memory map of the
+    file, so only the buffer is held in memory.
+    """
+
+    buffer_size = 1 << 16
+
+    def __init__(self, typecode, spill_dir, name='array'):
+        self.typecode = typecode
+        self.itemsize = array(typecode).itemsize
+        # a new file in spill_dir, runs using the same directory do not share files
+        fd, self.path = tempfile.mkstemp(prefix=name + '_', suffix='.bin', dir=spill_dir)
+        self.file = os.fdopen(fd, 'w+b')
+        self.pending = array(typecode)
+        self.flushed = 0
+        self.map = None
+
+    def __len__(self):
+        return self.flushed + len(self.pending)
+
+    def append(self, value):
+        self.pending.append(value)
+        if len(self.pending) >= self.buffer_size:
+            self.flush()
+
+    def extend(self, values):
+        self.pending.extend(values)
+        if len(self.pending) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.file.seek(0, 2)
+            self.pending.tofile(self.file)
+            self.file.flush()
+            self.flushed += len(self.pending)
+            self.pending = array(self.typecode)
+            # the map is recreated at the next read, to cover the new values
+            self.map = None
+
+    def read(self, start, stop):
+        values = array(self.typecode)
+        if start < self.flushed:
+            if self.map is None:
+                self.map = mmap.mmap(self.file.fileno(), self.flushed * self.itemsize, access=mmap.ACCESS_READ)
+            values.fromstring(self.map[start * self.itemsize: min(stop, self.flushed) * self.itemsize])
+        if stop > self.flushed:
+            values.extend(self.pending[max(start - self.flushed, 0): stop - self.flushed])
+        return values
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            values = self.read(start, max(start, stop))
+            if step != 1:
+                return values[::step]
+            return values
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('SpilledArray index out of range')
+        return self.read(key, key + 1)[0]
+
+    def __iter__(self):
+        for start in xrange(0, len(self), self.buffer_size):
+            for value in self.read(start, min(start + self.buffer_size, len(self))):
+                yield value
+
+    def close(self):
+        if self.file is None:
+            return
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+        self.file = None
+        os.remove(self.path)
+
+
+class SpilledRows(object):
+    """Append only list of attribute rows pickled one after the other in a file."""
+
+    def __init__(self, spill_dir):
+        fd, self.path = tempfile.mkstemp(prefix='attributes_', suffix='.bin', dir=spill_dir)
+        self.file = os.fdopen(fd, 'w+b')
+        self.positions = SpilledArray('l', spill_dir, 'attributes_idx')
+        self.positions.append(0)
+
+    def __len__(self):
+        return len(self.positions) - 1
+
+    def append(self, row):
+        self.file.seek(0, 2)
+        cPickle.dump(row, self.file, cPickle.HIGHEST_PROTOCOL)
+        self.positions.append(self.file.tell())
+
+    def __getitem__(self, index):
+        self.file.seek(self.positions[index])
+        return cPickle.load(self.file)
+
+    def close(self):
+        if self.file is None:
+            return
+        self.positions.close()
+        self.file.close()
+        self.file = None
+        os.remove(self.path)
+
+
+class EdgeCache(object):
+    """Values made from the edges of a store, kept for the size last used edges.
+
+    get(eid, make) returns the value of eid, made with make(eid) the first
+    time, and drops the least recently used value once size are kept.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = OrderedDict()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, eid):
+        return eid in self.values
+
+    def get(self, eid, make):
+        try:
+            value = self.values.pop(eid)
+        except KeyError:
+            value = make(eid)
+            if len(self.values) >= self.size:
+                self.values.popitem(last=False)
+        self.values[eid] = value
+        return value
+
+    def peek(self, eid):
+        # the value of eid if it is kept, without making it or marking it as used
+        return self.values.get(eid)
+
+    def drop(self, eid):
+        self.values.pop(eid, None)
+
+
+def coords_to_wkt(points):
+    # repr keeps the full precision of the float and gives the same string for
+    # the same coordinate, so vertices shared by two edges stay comparable as text
+    return 'LINESTRING(' + ', '.join(['%r %r' % (x, y) for x, y in points]) + ')'
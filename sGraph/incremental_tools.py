@@ -0,0 +1,294 @@
+
+# general imports
+import os
+import cPickle
+from qgis.core import QgsFeatureRequest, QgsRectangle, QgsGeometry, QgsVectorDataProvider
+
+# plugin module imports
+try:
+    from utilityFunctions import *
+    from break_tools import breakTool
+    from merge_tools import mergeTool
+    from spatial_index import OverlayIndex
+    from profiling import RunProfile, profiled
+except ImportError:
+    pass
+
+
+class incrementalTool(object):
+    """Cleans a layer once, then re-cleans only the edited parts of it.
+
+    The state of the last run is kept:
+    - the pieces of the broken network, with the id of the input feature
+      each piece comes from
+    - the cleaned network, with the pieces of each merged line
+    - the errors and the unlinks, keyed by the input ids
+    - a spatial index of the pieces and an index of their ends
+
+    An edit is given as changed ids and/or a dirty extent. It is broken
+    again together with the features it meets, and merged again together
+    with the chains that touch the pieces that changed. The rest of the
+    network is left as it is. The state can be saved and loaded between
+    sessions.
+    """
+
+    # attributes saved with the state
+    state = ['tolerance', 'snap_mode', 'break_engine', 'errors', 'unlinks', 'pieces', 'original_pieces',
+             'piece_index', 'piece_ends', 'piece_merged', 'merged', 'continuous', 'errors_features',
+             'unlinked_features', 'last_piece', 'last_merged']
+
+    def __init__(self, tolerance, errors, unlinks, snap_mode='truncate', break_engine='geos', profile=None):
+        self.tolerance = tolerance
+        self.snap_mode = snap_mode
+        self.break_engine = break_engine
+        self.errors = errors
+        self.unlinks = unlinks
+        self.profile = profile if profile is not None else RunProfile()
+        self.layer_fields = []
+
+        # {piece id: [original id, attributes, wkt]}
+        self.pieces = {}
+        self.original_pieces = {}
+        self.piece_index = OverlayIndex([], [])
+        # {end vertex: set(piece ids)}, vertices as given by edge_ends
+        self.piece_ends = {}
+        # {piece id: merged id}, pieces dropped by the merge (duplicates, orphans) have none
+        self.piece_merged = {}
+        # {merged id: [attributes, wkt, piece ids]}
+        self.merged = {}
+        # pieces merged with others into a continuous line
+        self.continuous = set()
+        # {original id: (errors, wkt)}
+        self.errors_features = {}
+        # (original id, original id, x, y, wkt)
+        self.unlinked_features = []
+        self.last_piece = 0
+        self.last_merged = 0
+
+    def save(self, path):
+        with open(path, 'wb') as state_file:
+            cPickle.dump(dict((name, getattr(self, name)) for name in self.state), state_file, cPickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path, profile=None):
+        with open(path, 'rb') as state_file:
+            state = cPickle.load(state_file)
+        tool = cls(state['tolerance'], state['errors'], state['unlinks'], profile=profile)
+        for name in cls.state:
+            setattr(tool, name, state[name])
+        return tool
+
+    @profiled('clean')
+    def clean(self, layer):
+        # full run, returns the cleaned network
+        br, broken_features = self.break_edges(layer, None)
+        removed_pieces, added_pieces = self.replace_pieces(br, broken_features, None)
+        self.merge_pieces(removed_pieces, added_pieces)
+        return self.merged_features()
+
+    @profiled('reclean')
+    def reclean(self, layer, changed_ids=None, dirty_extent=None):
+        # re-cleans the features of changed_ids (edited, added or deleted) and those in dirty_extent
+        # (xmin, ymin, xmax, ymax), returns the merged features removed from and added to the cleaned network
+        changed = set(changed_ids or [])
+        if dirty_extent is not None:
+            changed.update(self.layer_ids(layer, dirty_extent))
+            changed.update([self.pieces[pid][0] for pid in self.piece_index.intersects(dirty_extent)])
+
+        # the breaks of the features meeting a changed feature, before or after the edit, change too
+        bboxes = [self.piece_index.bboxes[pid] for fid in changed for pid in self.original_pieces.get(fid, [])]
+        bboxes += self.layer_bboxes(layer, changed).values()
+        affected = set(changed)
+        for bbox in bboxes:
+            affected.update([self.pieces[pid][0] for pid in self.piece_index.intersects(bbox)])
+            affected.update(self.layer_ids(layer, bbox))
+
+        # the affected features are broken again with all the features they meet
+        context = set(affected)
+        for bbox in self.layer_bboxes(layer, affected).values():
+            context.update(self.layer_ids(layer, bbox))
+
+        if context:
+            br, broken_features = self.break_edges(layer, QgsFeatureRequest().setFilterFids(sorted(context)))
+        else:
+            br, broken_features = None, []
+        removed_pieces, added_pieces = self.replace_pieces(br, broken_features, affected)
+        return self.merge_pieces(removed_pieces, added_pieces)
+
+    def layer_ids(self, layer, bbox):
+        # ids of the features of the layer whose bounding box meets bbox (grown by the snapping)
+        request = QgsFeatureRequest().setFilterRect(QgsRectangle(*self.grow(bbox))).setSubsetOfAttributes([])
+        return [f.id() for f in layer.getFeatures(request)]
+
+    def layer_bboxes(self, layer, fids):
+        bboxes = {}
+        if fids:
+            for f in layer.getFeatures(QgsFeatureRequest().setFilterFids(list(fids)).setSubsetOfAttributes([])):
+                rect = f.geometry().boundingBox()
+                bboxes[f.id()] = (rect.xMinimum(), rect.yMinimum(), rect.xMaximum(), rect.yMaximum())
+        return bboxes
+
+    def grow(self, bbox):
+        margin = 10 ** -self.tolerance if self.tolerance else 0
+        return bbox[0] - margin, bbox[1] - margin, bbox[2] + margin, bbox[3] + margin
+
+    def break_edges(self, layer, request):
+        br = breakTool(layer, self.tolerance, None, self.errors, self.unlinks, snap_mode=self.snap_mode,
+                       break_engine=self.break_engine, profile=self.profile)
+        br.add_edges(request=request)
+        self.layer_fields = br.layer_fields
+        broken_features = br.break_features()
+        if self.unlinks:
+            br.find_unlinks(broken_features)
+        return br, broken_features
+
+    def replace_pieces(self, br, broken_features, affected):
+        # replaces the pieces, errors and unlinks of the affected features (all when None) with those of the
+        # break run, returns the removed pieces as {piece id: (end, end)} and the ids of the added pieces
+        removed = {}
+        for fid in (affected if affected is not None else self.original_pieces.keys()):
+            for pid in self.original_pieces.pop(fid, []):
+                removed[pid] = edge_ends(self.pieces.pop(pid)[2])
+                if affected is not None:
+                    self.piece_index.delete(pid)
+                for end in removed[pid]:
+                    self.piece_ends[end].discard(pid)
+                    if not self.piece_ends[end]:
+                        del self.piece_ends[end]
+
+        added = []
+        added_bboxes = []
+        for new_fid, attrs, wkt in broken_features:
+            fid = br.ml_keys[br.br_keys[new_fid]]
+            if affected is None or fid in affected:
+                self.last_piece += 1
+                self.pieces[self.last_piece] = [fid, attrs, wkt]
+                self.original_pieces.setdefault(fid, []).append(self.last_piece)
+                vertices = [(float(x), float(y)) for x, y in vertices_from_wkt_2(wkt)]
+                xs, ys = zip(*vertices)
+                added_bboxes.append((min(xs), min(ys), max(xs), max(ys)))
+                if affected is not None:
+                    self.piece_index.insert(self.last_piece, added_bboxes[-1])
+                for end in edge_ends(wkt):
+                    self.piece_ends.setdefault(end, set()).add(self.last_piece)
+                added.append(self.last_piece)
+
+        if affected is None:
+            # on a full clean the index is packed once from all the pieces
+            self.piece_index = OverlayIndex(added, added_bboxes)
+            self.errors_features = {}
+            self.unlinked_features = []
+        else:
+            for fid in affected:
+                self.errors_features.pop(fid, None)
+            self.unlinked_features = [unlink for unlink in self.unlinked_features
+                                      if unlink[0] not in affected and unlink[1] not in affected]
+        if br is not None:
+            for fid, f_errors in br.errors_features.items():
+                if affected is None or fid in affected:
+                    self.errors_features[fid] = f_errors
+            for count, attrs, wkt in br.unlinked_features:
+                fid, gid = br.ml_keys[attrs[1][0]], br.ml_keys[attrs[2][0]]
+                if affected is None or fid in affected or gid in affected:
+                    self.unlinked_features.append((fid, gid, attrs[3][0], attrs[4][0], wkt))
+        return removed, added
+
+    def merge_pieces(self, removed, added):
+        # merges the chains that may have changed, returns the merged features removed and added
+        # a chain changes if it had a removed piece or ends where a piece was removed or added
+        nodes = set([end for ends in removed.values() for end in ends])
+        nodes.update([end for pid in added for end in self.piece_ends_of(pid)])
+        dissolved = set([self.piece_merged[pid] for pid in removed if pid in self.piece_merged])
+        dissolved.update([self.piece_merged[pid] for node in nodes for pid in self.piece_ends.get(node, [])
+                          if pid in self.piece_merged])
+
+        local = set(added)
+        local.update([pid for mid in dissolved for pid in self.merged[mid][2] if pid in self.pieces])
+        local.update([pid for node in nodes for pid in self.piece_ends.get(node, [])])
+        # pieces the last merge dropped (duplicates, orphans) at the ends of the local pieces
+        for pid in list(local):
+            for node in self.piece_ends_of(pid):
+                local.update([other for other in self.piece_ends[node] if other not in self.piece_merged])
+
+        # the pieces left out count in the degree of the vertices they share with the local ones
+        external_ends = {}
+        for pid in local:
+            for node in self.piece_ends_of(pid):
+                count = len([other for other in self.piece_ends[node] if other not in local])
+                if count:
+                    external_ends[node] = count
+
+        removed_features = []
+        for mid in sorted(dissolved):
+            attrs, wkt, chain = self.merged.pop(mid)
+            removed_features.append([mid, attrs, wkt])
+            for pid in chain:
+                self.continuous.discard(pid)
+                if self.piece_merged.get(pid) == mid:
+                    del self.piece_merged[pid]
+
+        added_features = []
+        if local:
+            features = [[pid, self.pieces[pid][1], self.pieces[pid][2]] for pid in sorted(local)]
+            mrg = mergeTool(features, None, self.errors, profile=self.profile, external_ends=external_ends)
+            for fid, attrs, wkt in mrg.merge():
+                chain = mrg.merged_from.get(fid, [fid])
+                self.last_merged += 1
+                self.merged[self.last_merged] = [attrs, wkt, chain]
+                for pid in chain:
+                    self.piece_merged[pid] = self.last_merged
+                if len(chain) > 1:
+                    self.continuous.update(chain)
+                added_features.append([self.last_merged, attrs, wkt])
+        return removed_features, added_features
+
+    def piece_ends_of(self, pid):
+        return edge_ends(self.pieces[pid][2])
+
+    def merged_features(self):
+        return [[mid, self.merged[mid][0], self.merged[mid][1]] for mid in sorted(self.merged.keys())]
+
+    def errors_list(self):
+        # as the errors of the cleaning tool, continuous lines are added to the errors of the features
+        errors_features = dict(self.errors_features)
+        for pid in self.continuous:
+            fid = self.pieces[pid][0]
+            try:
+                f_errors, wkt = errors_features[fid]
+                if 'continuous line' not in f_errors:
+                    errors_features[fid] = (f_errors + ', continuous line', wkt)
+            except KeyError:
+                errors_features[fid] = ('continuous line', self.pieces[pid][2])
+        return [[k, [[k], [v[0]]], v[1]] for k, v in sorted(errors_features.items())]
+
+    def unlinks_list(self):
+        return [[count, [[count], [fid], [gid], [x], [y]], wkt]
+                for count, (fid, gid, x, y, wkt) in enumerate(sorted(self.unlinked_features), start=1)]
+
+    def patch_layer(self, layer, removed_features, added_features, batch_size=10000):
+        # updates a cleaned layer in place: deletes the removed features (found by geometry) and adds the new ones
+        pr = layer.dataProvider()
+        editable = QgsVectorDataProvider.AddFeatures | QgsVectorDataProvider.DeleteFeatures
+        if pr.capabilities() & editable != editable:
+            # e.g. flatgeobuf files, they are written again with all the merged features
+            return self.rewrite_layer(layer)
+        delete_ids = set()
+        for mid, attrs, wkt in removed_features:
+            geom = QgsGeometry.fromWkt(wkt)
+            for f in layer.getFeatures(QgsFeatureRequest().setFilterRect(geom.boundingBox())):
+                if f.id() not in delete_ids and f.geometry().isGeosEqual(geom):
+                    delete_ids.add(f.id())
+                    break
+        pr.deleteFeatures(list(delete_ids))
+        add_in_batches(pr, make_features(added_features), batch_size)
+        layer.updateExtents()
+        return len(delete_ids)
+
+    def rewrite_layer(self, layer):
+        pr = layer.dataProvider()
+        path = layer.source().split('|')[0]
+        fields, crs, encoding, geom_type = list(pr.fields()), pr.crs(), pr.encoding(), pr.geometryType()
+        deleted = pr.featureCount()
+        os.remove(path)
+        to_file(path, self.merged_features(), fields, crs, layer.name(), encoding, geom_type)
+        return deleted
@@ -1,12 +1,14 @@
 
 # general imports
-import itertools
+from array import array
 from qgis.core import QgsGeometry
 from PyQt4.QtCore import QObject, pyqtSignal
 
 # plugin module imports
 try:
     from utilityFunctions import *
+    from chain_tools import find_chains, stitch_chain, connected_components
+    from profiling import RunProfile, profiled
 except ImportError:
     pass
 
@@ -18,113 +20,140 @@ class mergeTool(QObject):
     warning = pyqtSignal(str)
     killed = pyqtSignal(bool)
 
-    def __init__(self, features, uid, errors):
+    def __init__(self, features, uid, errors, endpoints=None, profile=None, external_ends=None, angle_threshold=5,
+                 orphan_edges=2, orphan_length=None):
         QObject.__init__(self)
-        self.features = features
-        self.last_fid = features[-1][0]
-        self.errors = errors
-        self.uid = uid
-
-        self.brkeys = {}
-        self.errors_features = {}
-
-        self.vertices_occur = {}
-        self.edges_occur = {}
-        self.f_dict = {}
-        self.self_loops = []
-
-        for i in self.features:
-            self.f_dict[i[0]] = [i[1], i[2]]
-            for vertex in vertices_from_wkt_2(i[2]):
-                break
-            first = vertex
-            for vertex in vertices_from_wkt_2(i[2]):
-                pass
-            last = vertex
-            try:
-                self.vertices_occur[first] += [i[0]]
-            except KeyError, e:
-                self.vertices_occur[first] = [i[0]]
-            try:
-                self.vertices_occur[last] += [i[0]]
-            except KeyError, e:
-                self.vertices_occur[last] = [i[0]]
-            pair = (last, first)
-            # strings are compared
-            if first[0] > last[0]:
-                pair = (first, last)
-            try:
-                self.edges_occur[pair] += [i[0]]
-            except KeyError, e:
-                self.edges_occur[pair] = [i[0]]
-
-        self.con_2 = {k: v for k, v in self.vertices_occur.items() if len(v) == 2}
-        # TODO: filter where also the angular change is 0 degrees
-        keys_to_del = []
-        for k, v in self.con_2.items():
-            all_vertices = []
-            for vertex in vertices_from_wkt_2(self.f_dict[v[0]][1]):
-                break
-            if vertex != k:
-                all_vertices.append(vertex)
-            for vertex in vertices_from_wkt_2(self.f_dict[v[0]][1]):
-                pass
-            if vertex != k:
-                all_vertices.append(vertex)
-            for vertex in vertices_from_wkt_2(self.f_dict[v[1]][1]):
-                break
-            if vertex != k:
-                all_vertices.append(vertex)
-            for vertex in vertices_from_wkt_2(self.f_dict[v[1]][1]):
-                pass
-            if vertex != k:
-                all_vertices.append(vertex)
-            if 180 - angle_3_points(k, all_vertices[0], all_vertices[1]) > 5:
-                keys_to_del.append(k)
-
-        for _k in keys_to_del:
-            del self.con_2[_k]
-
-        self.all_con = {}
-        for k, v in self.con_2.items():
-            try:
-                self.all_con[v[0]] += [v[1]]
-            except KeyError, e:
-                self.all_con[v[0]] = [v[1]]
-            try:
-                self.all_con[v[1]] += [v[0]]
-            except KeyError, e:
-                self.all_con[v[1]] = [v[0]]
-
-        self.parallel = {k: v for k, v in self.edges_occur.items() if len(v) >= 2}
-        self.duplicates = []
-        for k, v in self.parallel.items():
-            for x in itertools.combinations(v, 2):
-                if x[0] < x[1]:
-                    f_geom = QgsGeometry.fromWkt(self.f_dict[x[0]][1])
-                    g_geom = QgsGeometry.fromWkt(self.f_dict[x[1]][1])
-                    if f_geom.isGeosEqual(g_geom):
-                        self.duplicates.append(x[0])
-
-        self.all_fids = [i[0] for i in self.features]
-        self.fids_to_merge = list(set([fid for k, v in self.con_2.items() for fid in v]))
-        self.copy_fids = list(set(self.all_fids) - set(self.fids_to_merge))
-        self.feat_to_merge = [[i, self.f_dict[i][0], self.f_dict[i][1]] for i in self.fids_to_merge if i not in self.duplicates]
-        self.feat_to_copy =[[i, [[x] for x in self.f_dict[i][0]], self.f_dict[i][1]] for i in self.copy_fids if i not in self.duplicates]
-        self.con_1 = list(set([k for k, v in self.all_con.items() if len(v) == 1]))
-
-        self.edges_to_start = [[i, self.f_dict[i][0], self.f_dict[i][1]] for i in self.con_1 ]
+        self.profile = profile if profile is not None else RunProfile()
+        with self.profile.phase('mergeTool.__init__') as record:
+            record['features'] += len(features)
+            self.features = features
+            # {fid: (first vertex, last vertex)}
+            # the ends of each wkt are read once here (unless the table is given) and all passes look them up
+            if endpoints is None:
+                endpoints = dict((fid, edge_ends(wkt)) for (fid, attrs, wkt) in features)
+            self.endpoints = endpoints
+            # {vertex: number of edges ending there that are not in features}, when only a part of
+            # the network is merged (incremental cleaning) these count in the degree of the vertices
+            self.external_ends = external_ends or {}
+            self.last_fid = features[-1][0]
+            self.errors = errors
+            self.uid = uid
+            # largest deflection (in degrees) at a node where two edges are merged
+            self.angle_threshold = angle_threshold
+            # the isolated parts of the network with at most orphan_edges edges, or shorter than
+            # orphan_length, are orphans, they are left out of the output and kept in orphans
+            self.orphan_edges = orphan_edges
+            self.orphan_length = orphan_length
+            self.orphans = []
+
+            self.brkeys = {}
+            # {merged fid: fids of the edges of its chain}
+            self.merged_from = {}
+            self.errors_features = {}
+
+            self.vertices_occur = {}
+            self.edges_occur = {}
+            self.f_dict = {}
+            self.self_loops = []
+
+            for i in self.features:
+                self.f_dict[i[0]] = [i[1], i[2]]
+                first, last = self.endpoints[i[0]]
+                try:
+                    self.vertices_occur[first] += [i[0]]
+                except KeyError, e:
+                    self.vertices_occur[first] = [i[0]]
+                try:
+                    self.vertices_occur[last] += [i[0]]
+                except KeyError, e:
+                    self.vertices_occur[last] = [i[0]]
+                pair = (last, first)
+                # strings are compared
+                if first[0] > last[0]:
+                    pair = (first, last)
+                try:
+                    self.edges_occur[pair] += [i[0]]
+                except KeyError, e:
+                    self.edges_occur[pair] = [i[0]]
+
+            self.con_2 = {k: v for k, v in self.vertices_occur.items() if len(v) == 2 and k not in self.external_ends}
+            # the deflection at each node is taken between the far ends of its two edges,
+            # the coordinates are converted once and all the angles computed in one pass
+            nodes = self.con_2.items()
+            coords = array('d')
+            for k, v in nodes:
+                coords.extend([float(c) for c in k + self.far_end(v[0], k) + self.far_end(v[1], k)])
+            for (k, v), deflection in zip(nodes, deflection_angles(coords)):
+                if deflection > self.angle_threshold:
+                    del self.con_2[k]
+
+            self.all_con = {}
+            for k, v in self.con_2.items():
+                try:
+                    self.all_con[v[0]] += [v[1]]
+                except KeyError, e:
+                    self.all_con[v[0]] = [v[1]]
+                try:
+                    self.all_con[v[1]] += [v[0]]
+                except KeyError, e:
+                    self.all_con[v[1]] = [v[0]]
+
+            self.parallel = {k: v for k, v in self.edges_occur.items() if len(v) >= 2}
+            self.duplicates = []
+            for k, v in self.parallel.items():
+                self.duplicates += self.find_duplicates(v)
+
+            self.all_fids = [i[0] for i in self.features]
+            self.fids_to_merge = list(set([fid for k, v in self.con_2.items() for fid in v]))
+            self.copy_fids = list(set(self.all_fids) - set(self.fids_to_merge))
+            self.feat_to_merge = [[i, self.f_dict[i][0], self.f_dict[i][1]] for i in self.fids_to_merge if i not in self.duplicates]
+            self.feat_to_copy =[[i, [[x] for x in self.f_dict[i][0]], self.f_dict[i][1]] for i in self.copy_fids if i not in self.duplicates]
+            self.con_1 = list(set([k for k, v in self.all_con.items() if len(v) == 1]))
+
+            self.edges_to_start = [[i, self.f_dict[i][0], self.f_dict[i][1]] for i in self.con_1 ]
+
+    def far_end(self, fid, vertex):
+        # the end of the edge that is not vertex (vertex itself for a closed edge)
+        first, last = self.endpoints[fid]
+        if first == vertex:
+            return last
+        return first
+
+    def find_duplicates(self, fids):
+        # fids of edges with the same ends, returns those equal to an edge with a higher fid
+        # the edges with the same vertices (in either direction) are grouped by hash in one pass,
+        # geos only compares the groups left, equal lines with different vertices
+        groups = {}
+        for fid in fids:
+            groups.setdefault(canonical_vertices(self.f_dict[fid][1]), []).append(fid)
+        groups = [sorted(group) for group in groups.values()]
+
+        if len(groups) > 1:
+            # the groups of the geos equal lines are joined
+            joined = []
+            for group in sorted(groups, key=lambda group: group[-1]):
+                geom = QgsGeometry.fromWkt(self.f_dict[group[-1]][1])
+                for other_geom, other_group in joined:
+                    self.profile.count('geos_calls')
+                    if geom.isGeosEqual(other_geom):
+                        other_group += group
+                        break
+                else:
+                    joined.append((geom, group))
+            groups = [sorted(group) for geom, group in joined]
 
+        return [fid for group in groups for fid in group[:-1]]
+
+    @profiled('merge', features=lambda self, result: len(result))
     def merge(self):
 
         merged_features = []
 
-        akra_count = len(self.con_1)
+        chains = find_chains(self.all_con)
+        akra_count = len(chains)
         f_count = 1
 
-        edges_passed = []
-        all_trees = []
-        for edge in self.con_1:
+        for tree in chains:
 
             if self.killed is True:
                 break
@@ -132,99 +161,82 @@ class mergeTool(QObject):
             self.progress.emit((45 * f_count / akra_count) + 45)
             f_count += 1
 
-            if edge not in edges_passed:
-                edges_passed.append(edge)
-                tree = [edge]
-                n_iter = 0
-                x = 0
-                while True:
-                    last = tree[-1]
-                    n_iter += 1
-                    x += 1
-                    # TODO in con_1 or is self loop
-                    if last in self.con_1 and n_iter != 1:
-                        edges_passed.append(last)
-                        n_iter = 0
-                        break
-                    else:
-                        len_tree = len(tree)
-                        tree = get_next_vertex(tree, self.all_con)
-                        if len(tree) == len_tree:
-                            n_iter = 0
-                            #print "hit end"
-                            break
-                    if x > 100:
-                        x = 0
-                        print "infinite"
-                        break
-                all_trees.append(tree)
-
-                # merge attributes
-                f_attrs_list = [self.f_dict[node][0] for node in tree]
-                f_attrs = []
-
-                if self.errors:
-                    for node in tree:
-                        self.errors_features[node] = ('continuous line', None)
-
-                for i in range(0, len(f_attrs_list[0])):
-                    f_attrs += [[f_attr[i] for f_attr in f_attrs_list]]
-                f_attrs = [list(set(item)) for item in f_attrs]
-                geom_to_merge = [QgsGeometry.fromWkt(self.f_dict[node][1]) for node in tree]
-                for ind, line in enumerate(geom_to_merge[1:], start=1):
-                    second_geom = line
-                    first_geom = geom_to_merge[(ind - 1) % len(tree)]
-                    new_geom = second_geom.combine(first_geom)
-                    geom_to_merge[ind] = new_geom
-                if new_geom.wkbType() == 5:
-                    for linestring in new_geom.asGeometryCollection():
-                        self.last_fid += 1
-                        new_feat = [self.last_fid, f_attrs, linestring.exportToWkt()]
-                        merged_features.append(new_feat)
-                elif new_geom.wkbType() == 2:
+            # merge attributes
+            f_attrs_list = [self.f_dict[node][0] for node in tree]
+            f_attrs = []
+
+            if self.errors:
+                for node in tree:
+                    self.errors_features[node] = ('continuous line', None)
+
+            for i in range(0, len(f_attrs_list[0])):
+                f_attrs += [[f_attr[i] for f_attr in f_attrs_list]]
+            f_attrs = [list(set(item)) for item in f_attrs]
+            # chains are ordered end to end, the vertices of the edges are concatenated
+            merged_vertices = stitch_chain([list(vertices_from_wkt_2(self.f_dict[node][1])) for node in tree])
+            if merged_vertices is not None:
+                self.last_fid += 1
+                self.endpoints[self.last_fid] = (merged_vertices[0], merged_vertices[-1])
+                self.merged_from[self.last_fid] = tree
+                new_feat = [self.last_fid, f_attrs, wkt_from_vertices(merged_vertices)]
+                merged_features.append(new_feat)
+                continue
+
+            # ambiguous order of the ends, fall back to geos
+            geom_to_merge = [QgsGeometry.fromWkt(self.f_dict[node][1]) for node in tree]
+            new_geom = geom_to_merge[0]
+            for ind, line in enumerate(geom_to_merge[1:], start=1):
+                second_geom = line
+                first_geom = geom_to_merge[(ind - 1) % len(tree)]
+                new_geom = second_geom.combine(first_geom)
+                self.profile.count('geos_calls')
+                geom_to_merge[ind] = new_geom
+            if new_geom.wkbType() == 5:
+                for linestring in new_geom.asGeometryCollection():
                     self.last_fid += 1
-                    new_feat = [self.last_fid, f_attrs, new_geom.exportToWkt()]
+                    self.merged_from[self.last_fid] = tree
+                    new_feat = [self.last_fid, f_attrs, linestring.exportToWkt()]
                     merged_features.append(new_feat)
+            elif new_geom.wkbType() == 2:
+                self.last_fid += 1
+                self.merged_from[self.last_fid] = tree
+                new_feat = [self.last_fid, f_attrs, new_geom.exportToWkt()]
+                merged_features.append(new_feat)
 
         return self.exclude_orphans(merged_features + self.feat_to_copy)
 
+    @profiled('exclude_orphans', features=lambda self, result: len(result))
     def exclude_orphans(self, all_features):
-
-        merged_features_w_o_orphans = []
-        ends_occur = {}
+        # the connected components of the output are found from the ends of the edges,
+        # a component reaching a vertex of external_ends is part of the rest of the network
+        ends = []
         for (fid, attrs, wkt) in all_features:
-            end0, end1 = None, None
-
-            for i in vertices_from_wkt_2(wkt):
-                end0 = i
-                break
-            for i in vertices_from_wkt_2(wkt):
-                pass
-            end1 = i
-            if end0 and end1:
-                try: ends_occur[end0] += 1
-                except KeyError: ends_occur[end0] = 1
-                try: ends_occur[end1] += 1
-                except KeyError: ends_occur[end1] = 1
+            try:
+                ends.append(self.endpoints[fid])
+            except KeyError:
+                ends.append(edge_ends(wkt))
+        components = connected_components(ends)
+
+        count = max(components) + 1 if components else 0
+        edges_count = [0] * count
+        length = [0.0] * count
+        connected = [False] * count
+        for (fid, attrs, wkt), (end0, end1), component in zip(all_features, ends, components):
+            edges_count[component] += 1
+            if end0 in self.external_ends or end1 in self.external_ends:
+                connected[component] = True
+            if self.orphan_length is not None:
+                length[component] += wkt_length(wkt)
+
+        is_orphan = [not connected[c] and (edges_count[c] <= self.orphan_edges or
+                                           (self.orphan_length is not None and length[c] < self.orphan_length))
+                     for c in xrange(count)]
 
-        for (fid, attrs, wkt) in all_features:
-            for i in vertices_from_wkt_2(wkt):
-                end0 = i
-                break
-            for i in vertices_from_wkt_2(wkt):
-                pass
-            end1 = i
-            if ends_occur[end0]==1 and ends_occur[end1]==1:
-                pass
+        merged_features_w_o_orphans = []
+        for feature, component in zip(all_features, components):
+            if is_orphan[component]:
+                self.orphans.append(feature)
             else:
-                merged_features_w_o_orphans.append([fid, attrs, wkt])
+                merged_features_w_o_orphans.append(feature)
 
         return merged_features_w_o_orphans
-
-
-
-
-
-
-
-
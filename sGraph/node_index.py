@@ -0,0 +1,208 @@
+# general imports
+import heapq
+
+
+class VertexIndex(object):
+    """Hash of the snapped vertices of an EdgeStore.
+
+    Maps every (x, y) vertex to the list of (edge id, vertex index) where it
+    occurs, so vertices shared between edges are found with one lookup per
+    vertex instead of one intersection per pair of edges.
+    """
+
+    def __init__(self, store):
+        self.vertices = {}
+        for eid in store.ids():
+            for index, vertex in enumerate(store.vertices(eid)):
+                try:
+                    self.vertices[vertex].append((eid, index))
+                except KeyError:
+                    self.vertices[vertex] = [(eid, index)]
+
+    def occurrences(self, vertex):
+        return self.vertices.get(vertex, [])
+
+    def shared_vertices(self, eid, points):
+        # returns {other edge id: set of indices of the vertices of eid it shares}
+        # only the first occurrence of a repeated vertex is used (as list.index does)
+        shared = {}
+        seen = set()
+        for index, vertex in enumerate(points):
+            if vertex in seen:
+                continue
+            seen.add(vertex)
+            for gid, g_index in self.vertices[vertex]:
+                if gid != eid:
+                    try:
+                        shared[gid].add(index)
+                    except KeyError:
+                        shared[gid] = set([index])
+        return shared
+
+
+def orientation(p, q, r):
+    val = (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+    if val > 0:
+        return 1
+    elif val < 0:
+        return -1
+    return 0
+
+
+def on_segment(p, q, r):
+    # r is collinear with p, q: is it within the bounding box of p, q
+    return min(p[0], q[0]) <= r[0] <= max(p[0], q[0]) and min(p[1], q[1]) <= r[1] <= max(p[1], q[1])
+
+
+def segments_touch_between_vertices(p1, p2, q1, q2):
+    # True if segments p1p2 and q1q2 meet anywhere other than a common endpoint
+    o1 = orientation(p1, p2, q1)
+    o2 = orientation(p1, p2, q2)
+    o3 = orientation(q1, q2, p1)
+    o4 = orientation(q1, q2, p2)
+
+    if o1 == o2 == o3 == o4 == 0:
+        # collinear segments: touching at one common endpoint or overlapping
+        if not (on_segment(p1, p2, q1) or on_segment(p1, p2, q2) or on_segment(q1, q2, p1)):
+            return False
+        common = set([p1, p2]) & set([q1, q2])
+        if len(common) == 1:
+            # they only touch at the common end if they point away from each other
+            c = common.pop()
+            p_other = p2 if p1 == c else p1
+            q_other = q2 if q1 == c else q1
+            return (p_other[0] - c[0]) * (q_other[0] - c[0]) + (p_other[1] - c[1]) * (q_other[1] - c[1]) > 0
+        return True
+
+    if p1 in (q1, q2) or p2 in (q1, q2):
+        # non collinear segments sharing an endpoint meet only there
+        return False
+
+    if o1 != o2 and o3 != o4:
+        return True
+    if o1 == 0 and on_segment(p1, p2, q1):
+        return True
+    if o2 == 0 and on_segment(p1, p2, q2):
+        return True
+    if o3 == 0 and on_segment(q1, q2, p1):
+        return True
+    if o4 == 0 and on_segment(q1, q2, p2):
+        return True
+    return False
+
+
+def polylines_touch_between_vertices(f_points, g_points):
+    # True if the polylines meet (cross, touch or overlap) anywhere other than at shared vertices
+    xs = [p[0] for p in f_points]
+    ys = [p[1] for p in f_points]
+    f_xmin, f_xmax, f_ymin, f_ymax = min(xs), max(xs), min(ys), max(ys)
+    g_segments = []
+    for q1, q2 in zip(g_points[:-1], g_points[1:]):
+        if max(q1[0], q2[0]) < f_xmin or min(q1[0], q2[0]) > f_xmax:
+            continue
+        if max(q1[1], q2[1]) < f_ymin or min(q1[1], q2[1]) > f_ymax:
+            continue
+        g_segments.append((q1, q2, min(q1[0], q2[0]), max(q1[0], q2[0]), min(q1[1], q2[1]), max(q1[1], q2[1])))
+    if not g_segments:
+        return False
+    for p1, p2 in zip(f_points[:-1], f_points[1:]):
+        p_xmin, p_xmax = min(p1[0], p2[0]), max(p1[0], p2[0])
+        p_ymin, p_ymax = min(p1[1], p2[1]), max(p1[1], p2[1])
+        for q1, q2, q_xmin, q_xmax, q_ymin, q_ymax in g_segments:
+            if q_xmax < p_xmin or q_xmin > p_xmax or q_ymax < p_ymin or q_ymin > p_ymax:
+                continue
+            if segments_touch_between_vertices(p1, p2, q1, q2):
+                return True
+    return False
+
+
+def repeated_vertices(points):
+    # indices of the first occurrence of every vertex found more than once, counted in a hash
+    counts = {}
+    for vertex in points:
+        counts[vertex] = counts.get(vertex, 0) + 1
+    indices = []
+    for index, vertex in enumerate(points):
+        if counts[vertex] > 1:
+            indices.append(index)
+            # later occurrences are skipped
+            counts[vertex] = 0
+    return indices
+
+
+def self_crosses(points):
+    # True if two segments of the polyline meet anywhere other than a common vertex. Segments following
+    # each other only overlap where the line doubles back on itself. The other segments are swept by their
+    # minimum x and each one is tested only against the active segments (those whose x range reaches it),
+    # kept in a heap by their maximum x
+    for p0, p1, p2 in zip(points[:-2], points[1:-1], points[2:]):
+        if orientation(p0, p1, p2) == 0 and (p0[0] - p1[0]) * (p2[0] - p1[0]) + (p0[1] - p1[1]) * (p2[1] - p1[1]) > 0:
+            return True
+    segments = sorted([(min(p1[0], p2[0]), max(p1[0], p2[0]), min(p1[1], p2[1]), max(p1[1], p2[1]), index)
+                       for index, (p1, p2) in enumerate(zip(points[:-1], points[1:]))])
+    active = []
+    for xmin, xmax, ymin, ymax, index in segments:
+        while active and active[0][0] < xmin:
+            heapq.heappop(active)
+        for a_xmax, a_index, a_ymin, a_ymax in active:
+            if a_ymax < ymin or a_ymin > ymax or abs(index - a_index) == 1:
+                continue
+            if segments_touch_between_vertices(points[index], points[index + 1], points[a_index], points[a_index + 1]):
+                return True
+        heapq.heappush(active, (xmax, index, ymin, ymax))
+    return False
+
+
+def crossing_point(p1, p2, q1, q2):
+    # the point where segments p1p2 and q1q2 cross if they cross properly (each one has its ends
+    # strictly on either side of the other), None otherwise
+    if orientation(p1, p2, q1) * orientation(p1, p2, q2) >= 0:
+        return None
+    if orientation(q1, q2, p1) * orientation(q1, q2, p2) >= 0:
+        return None
+    d = (p2[0] - p1[0]) * (q2[1] - q1[1]) - (p2[1] - p1[1]) * (q2[0] - q1[0])
+    t = ((q1[0] - p1[0]) * (q2[1] - q1[1]) - (q1[1] - p1[1]) * (q2[0] - q1[0])) / d
+    return p1[0] + t * (p2[0] - p1[0]), p1[1] + t * (p2[1] - p1[1])
+
+
+def vertex_crossing(p0, p1, p2, q1, q2):
+    # p1 is a vertex of a line between p0 and p2 (p0 is None at the start of an open line): returns p1
+    # if it lies strictly inside segment q1q2 and the line goes on to the other side of it, None otherwise
+    if p0 is None or p1 in (q1, q2) or orientation(q1, q2, p1) != 0 or not on_segment(q1, q2, p1):
+        return None
+    if orientation(q1, q2, p0) * orientation(q1, q2, p2) >= 0:
+        return None
+    return p1
+
+
+def proper_crossings(polylines):
+    # polylines: (id, points) pairs, returns (lower id, higher id, x, y) for every two segments of different
+    # polylines crossing without a common vertex (bridges, tunnels): where the segments cross properly or
+    # where a vertex of one line lies inside a segment of the other and the line goes through it
+    # the segments of all the polylines are swept by their minimum x as in self_crosses, a vertex is only
+    # tested with the segment it starts (and the one before it) so each crossing is found once
+    segments = []
+    for pid, points in polylines:
+        closed = len(points) > 2 and points[0] == points[-1]
+        for index, (p1, p2) in enumerate(zip(points[:-1], points[1:])):
+            if index > 0:
+                p0 = points[index - 1]
+            else:
+                p0 = points[-2] if closed else None
+            segments.append((min(p1[0], p2[0]), max(p1[0], p2[0]), min(p1[1], p2[1]), max(p1[1], p2[1]), pid,
+                             p0, p1, p2))
+    segments.sort(key=lambda segment: segment[0])
+    crossings = []
+    active = []
+    for index, (xmin, xmax, ymin, ymax, pid, p0, p1, p2) in enumerate(segments):
+        while active and active[0][0] < xmin:
+            heapq.heappop(active)
+        for a_xmax, a_index, a_ymin, a_ymax, a_pid, q0, q1, q2 in active:
+            if a_pid == pid or a_ymax < ymin or a_ymin > ymax:
+                continue
+            point = crossing_point(p1, p2, q1, q2) or vertex_crossing(p0, p1, p2, q1, q2) or \
+                vertex_crossing(q0, q1, q2, p1, p2)
+            if point is not None:
+                crossings.append((min(pid, a_pid), max(pid, a_pid), point[0], point[1]))
+        heapq.heappush(active, (xmax, index, ymin, ymax, pid, p0, p1, p2))
+    return crossings
@@ -0,0 +1,460 @@
+
+# general imports
+import psycopg2
+from psycopg2.extensions import AsIs
+
+# plugin module imports
+try:
+    from profiling import RunProfile, profiled
+except ImportError:
+    pass
+
+
+class postgisTool(object):
+    """Cleans a network stored in PostGIS inside the database.
+
+    The same steps as breakTool and mergeTool run as set based queries on
+    temporary tables, so the features never leave the server:
+    - the edges are the parts of the input lines, snapped like breakTool does
+    - every pair of edges meeting (found with the GiST index) is intersected
+      once, the edges break at the vertices where they meet, where a
+      partial overlap starts or stops and where they repeat a vertex
+    - the broken pieces are grouped in chains through the nodes mergeTool
+      merges (degree 2 and no turn) and each chain is merged with ST_LineMerge
+    - duplicates and orphans are left out
+    The cleaned network, its errors and its unlinks are written to tables of
+    the database. The errors use the same categories as the python tools.
+    """
+
+    def __init__(self, connstring, schema, table, tolerance, errors, unlinks, snap_mode='truncate',
+                 geom_column='geom', id_column='id', angle_threshold=5, orphan_edges=2, orphan_length=None,
+                 profile=None):
+        self.connstring = connstring
+        self.schema = schema
+        self.table = table
+        self.tolerance = tolerance
+        self.snap_mode = snap_mode
+        self.errors = errors
+        self.unlinks = unlinks
+        self.geom_column = geom_column
+        self.id_column = id_column
+        self.angle_threshold = angle_threshold
+        self.orphan_edges = orphan_edges
+        self.orphan_length = orphan_length
+        self.profile = profile if profile is not None else RunProfile()
+        self.con = None
+        self.cur = None
+        self.params = {}
+        self.columns = []
+
+    @profiled('postgis.clean')
+    def clean(self, out_schema, out_table, errors_table=None, unlinks_table=None):
+        # writes the cleaned network to out_schema.out_table (and the errors and unlinks to
+        # errors_table and unlinks_table, as (schema, table)), returns the number of rows of each
+        self.con = psycopg2.connect(self.connstring)
+        self.cur = self.con.cursor()
+        try:
+            self.prepare(out_schema, out_table, errors_table, unlinks_table)
+            counts = {'edges': self.read_edges()}
+            counts['broken'] = self.break_edges()
+            if self.unlinks:
+                counts['unlinks'] = self.find_unlinks()
+            counts['cleaned'] = self.merge_pieces()
+            if self.errors:
+                counts['errors'] = self.write_errors()
+            self.con.commit()
+        except psycopg2.Error:
+            self.con.rollback()
+            raise
+        finally:
+            self.con.close()
+        return counts
+
+    def execute(self, query):
+        self.cur.execute(self.cur.mogrify(query, self.params))
+        return self.cur.rowcount
+
+    def prepare(self, out_schema, out_table, errors_table, unlinks_table):
+        self.cur.execute("""SELECT column_name FROM information_schema.columns
+                            WHERE table_schema = %s AND table_name = %s AND column_name <> %s
+                            ORDER BY ordinal_position""", (self.schema, self.table, self.geom_column))
+        self.columns = [row[0] for row in self.cur.fetchall()]
+        self.cur.execute("""SELECT Find_SRID(%s, %s, %s)""", (self.schema, self.table, self.geom_column))
+        srid = self.cur.fetchone()[0]
+
+        self.params = {'src': AsIs(quoted(self.schema, self.table)),
+                       'geom': AsIs(quoted(self.geom_column)),
+                       'id': AsIs(quoted(self.id_column)),
+                       'srid': srid,
+                       'snap_x': AsIs(self.snap_expression('ST_X(p.geom)')),
+                       'snap_y': AsIs(self.snap_expression('ST_Y(p.geom)')),
+                       'angle_threshold': float(self.angle_threshold),
+                       'orphan_edges': int(self.orphan_edges),
+                       'orphan_length': self.orphan_length,
+                       'out': AsIs(quoted(out_schema, out_table)),
+                       'out_index': AsIs(quoted(out_table + '_geom_idx')),
+                       'attributes': AsIs(''.join(['array_remove(array_agg(DISTINCT s.%s), NULL) AS %s, ' % (
+                           quoted(column), quoted(column)) for column in self.columns]))}
+        if errors_table:
+            self.params['errors_out'] = AsIs(quoted(*errors_table))
+            self.params['errors_index'] = AsIs(quoted(errors_table[1] + '_geom_idx'))
+        if unlinks_table:
+            self.params['unlinks_out'] = AsIs(quoted(*unlinks_table))
+            self.params['unlinks_index'] = AsIs(quoted(unlinks_table[1] + '_geom_idx'))
+
+    def snap_expression(self, coordinate):
+        # the snapping of snap_coords, in sql, when breakTool snaps (not without a tolerance or with 0)
+        if not self.tolerance:
+            return coordinate
+        scale = repr(float(10 ** self.tolerance))
+        if self.snap_mode == 'round':
+            return 'floor(%s * %s + 0.5) / %s' % (coordinate, scale, scale)
+        return 'trunc(round((%s * %s)::numeric, 6))::float8 / %s' % (coordinate, scale, scale)
+
+    def read_edges(self):
+        with self.profile.phase('postgis.read_edges') as record:
+            # the parts of the multipart features and the valid lines, as breakTool.add_edges
+            self.execute("""
+                CREATE TEMP TABLE rcl_input_errors AS
+                SELECT s.%(id)s AS original_id,
+                       CASE GeometryType(s.%(geom)s) WHEN 'MULTILINESTRING' THEN 'multipart'
+                                                     WHEN 'POINT' THEN 'point'
+                                                     ELSE 'invalid' END AS errors
+                FROM %(src)s s
+                WHERE GeometryType(s.%(geom)s) IN ('MULTILINESTRING', 'POINT') OR NOT ST_IsValid(s.%(geom)s);
+
+                CREATE TEMP TABLE rcl_edges AS
+                SELECT row_number() OVER (ORDER BY s.%(id)s, d.path) AS eid, s.%(id)s AS original_id, d.geom
+                FROM %(src)s s, ST_Dump(ST_Force2D(s.%(geom)s)) d
+                WHERE GeometryType(d.geom) = 'LINESTRING'
+                AND (GeometryType(s.%(geom)s) = 'MULTILINESTRING' OR ST_IsValid(s.%(geom)s));
+
+                CREATE TEMP TABLE rcl_vertices AS
+                SELECT e.eid, (p.path)[1] - 1 AS idx, %(snap_x)s AS x, %(snap_y)s AS y
+                FROM rcl_edges e, ST_DumpPoints(e.geom) p;
+                CREATE INDEX rcl_vertices_idx ON rcl_vertices (eid, idx);
+
+                CREATE TEMP TABLE rcl_lines AS
+                SELECT v.eid, e.original_id, count(*) AS n_vertices,
+                       ST_SetSRID(ST_MakeLine(array_agg(ST_MakePoint(v.x, v.y) ORDER BY v.idx)), %(srid)s) AS geom
+                FROM rcl_vertices v JOIN rcl_edges e USING (eid)
+                GROUP BY v.eid, e.original_id;
+                CREATE UNIQUE INDEX rcl_lines_eid_idx ON rcl_lines (eid);
+                CREATE INDEX rcl_lines_geom_idx ON rcl_lines USING GIST (geom);
+                ANALYZE rcl_lines;
+
+                -- {vertex: first index} of every edge, as breakTool.vertex_positions
+                CREATE TEMP TABLE rcl_positions AS
+                SELECT eid, x, y, min(idx) AS idx, count(*) AS occurrences
+                FROM rcl_vertices GROUP BY eid, x, y;
+                CREATE INDEX rcl_positions_idx ON rcl_positions (eid, x, y);
+                """)
+            self.cur.execute("""SELECT count(*) FROM rcl_lines""")
+            edges = self.cur.fetchone()[0]
+            record['features'] += edges
+        return edges
+
+    def break_edges(self):
+        with self.profile.phase('postgis.break_edges') as record:
+            # every pair once, from the lower id: the edge with the higher id is the duplicate
+            self.execute("""
+                CREATE TEMP TABLE rcl_pairs AS
+                SELECT a.eid AS fid, b.eid AS gid, ST_Equals(a.geom, b.geom) AS is_equal,
+                       ST_Intersection(a.geom, b.geom) AS inter,
+                       ST_Length(a.geom) AS f_length, ST_Length(b.geom) AS g_length
+                FROM rcl_lines a JOIN rcl_lines b
+                ON a.eid < b.eid AND a.geom && b.geom AND ST_Intersects(a.geom, b.geom);
+
+                -- the vertices where each edge breaks, as breakTool.intersection_breakages:
+                -- intersection points, the ends of a single overlap shorter than the edge,
+                -- the ends of a multiple overlap and the repeated vertices
+                CREATE TEMP TABLE rcl_breaks AS
+                WITH points AS (
+                    SELECT fid, gid, (ST_Dump(inter)).geom AS geom, 'point'::text AS kind, 0.0::float8 AS length,
+                           f_length, g_length
+                    FROM rcl_pairs WHERE NOT is_equal AND GeometryType(inter) IN ('POINT', 'MULTIPOINT')
+                    UNION ALL
+                    SELECT fid, gid, ST_StartPoint(inter), 'line', ST_Length(inter), f_length, g_length
+                    FROM rcl_pairs WHERE NOT is_equal AND GeometryType(inter) = 'LINESTRING'
+                    UNION ALL
+                    SELECT fid, gid, ST_EndPoint(inter), 'line', ST_Length(inter), f_length, g_length
+                    FROM rcl_pairs WHERE NOT is_equal AND GeometryType(inter) = 'LINESTRING'
+                    UNION ALL
+                    SELECT fid, gid, ST_StartPoint(ST_GeometryN(inter, 1)), 'multiline', ST_Length(inter),
+                           f_length, g_length
+                    FROM rcl_pairs WHERE NOT is_equal AND GeometryType(inter) = 'MULTILINESTRING'
+                    UNION ALL
+                    SELECT fid, gid, ST_EndPoint(ST_GeometryN(inter, ST_NumGeometries(inter))), 'multiline',
+                           ST_Length(inter), f_length, g_length
+                    FROM rcl_pairs WHERE NOT is_equal AND GeometryType(inter) = 'MULTILINESTRING'
+                ), sides AS (
+                    SELECT fid AS eid, geom, kind, length <> f_length AS partial FROM points
+                    UNION ALL
+                    SELECT gid, geom, kind, length <> g_length FROM points
+                )
+                SELECT s.eid, p.idx, CASE WHEN s.kind = 'multiline' THEN 'overlap' ELSE 'break' END AS kind
+                FROM sides s JOIN rcl_positions p ON p.eid = s.eid AND p.x = ST_X(s.geom) AND p.y = ST_Y(s.geom)
+                WHERE s.kind = 'point' OR s.partial
+                UNION
+                SELECT eid, idx, 'self' FROM rcl_positions WHERE occurrences > 1;
+                CREATE INDEX rcl_breaks_idx ON rcl_breaks (eid);
+
+                -- the errors of each edge, as breakTool.find_breakages
+                CREATE TEMP TABLE rcl_facts AS
+                WITH facts AS (
+                    SELECT l.eid, l.original_id, l.n_vertices, ST_IsClosed(l.geom) AS is_closed,
+                           EXISTS (SELECT 1 FROM rcl_pairs p WHERE p.gid = l.eid AND p.is_equal) AS is_duplicate,
+                           EXISTS (SELECT 1 FROM rcl_breaks b WHERE b.eid = l.eid AND b.kind = 'break') AS must_break,
+                           EXISTS (SELECT 1 FROM rcl_breaks b WHERE b.eid = l.eid AND b.kind = 'overlap') AS has_overlaps,
+                           EXISTS (SELECT 1 FROM rcl_breaks b WHERE b.eid = l.eid AND b.kind = 'self')
+                               OR NOT ST_IsSimple(l.geom) AS is_self_intersecting,
+                           (SELECT count(*) FROM (SELECT idx FROM rcl_breaks b WHERE b.eid = l.eid
+                                                  UNION SELECT 0 UNION SELECT l.n_vertices - 1) v) AS n_vertices_to_break
+                    FROM rcl_lines l
+                )
+                SELECT eid, original_id, n_vertices,
+                       CASE WHEN is_duplicate THEN 'duplicate'
+                            WHEN NOT (must_break OR has_overlaps) AND is_closed THEN 'closed polyline'
+                            WHEN NOT (must_break OR has_overlaps) THEN 'orphan'
+                            WHEN is_self_intersecting AND has_overlaps THEN 'breakage, overlap'
+                            WHEN is_self_intersecting THEN 'breakage'
+                            WHEN has_overlaps AND must_break THEN 'breakage, overlap'
+                            WHEN has_overlaps THEN 'overlap'
+                            WHEN n_vertices_to_break > 2 THEN 'breakage'
+                       END AS errors
+                FROM facts;
+
+                -- the pieces between consecutive breaking vertices of the edges kept
+                CREATE TEMP TABLE rcl_pieces AS
+                WITH kept AS (
+                    SELECT * FROM rcl_facts
+                    WHERE errors IS NULL OR errors NOT IN ('duplicate', 'closed polyline', 'orphan')
+                ), cuts AS (
+                    SELECT k.eid, b.idx FROM kept k JOIN rcl_breaks b USING (eid) WHERE k.errors IS NOT NULL
+                    UNION SELECT eid, 0 FROM kept
+                    UNION SELECT eid, n_vertices - 1 FROM kept
+                ), spans AS (
+                    SELECT eid, idx AS first_idx, lead(idx) OVER (PARTITION BY eid ORDER BY idx) AS last_idx
+                    FROM cuts
+                )
+                SELECT row_number() OVER (ORDER BY s.eid, s.first_idx) AS pid, s.eid, k.original_id,
+                       (SELECT ST_SetSRID(ST_MakeLine(array_agg(ST_MakePoint(v.x, v.y) ORDER BY v.idx)), %(srid)s)
+                        FROM rcl_vertices v
+                        WHERE v.eid = s.eid AND v.idx BETWEEN s.first_idx AND s.last_idx) AS geom
+                FROM spans s JOIN kept k USING (eid)
+                WHERE s.last_idx IS NOT NULL;
+                CREATE INDEX rcl_pieces_geom_idx ON rcl_pieces USING GIST (geom);
+                ANALYZE rcl_pieces;
+                """)
+            self.cur.execute("""SELECT count(*) FROM rcl_pieces""")
+            pieces = self.cur.fetchone()[0]
+            record['features'] += pieces
+        return pieces
+
+    def find_unlinks(self):
+        with self.profile.phase('postgis.find_unlinks') as record:
+            # as breakTool.find_unlinks: the edges kept by the break crossing without a common vertex,
+            # where neither line has a vertex or where a vertex of one line lies inside a segment of the
+            # other and the line goes on to the other side of it (the ends of a closed line included)
+            self.execute("""
+                DROP TABLE IF EXISTS %(unlinks_out)s;
+                CREATE TABLE %(unlinks_out)s AS
+                WITH kept AS (
+                    SELECT eid FROM rcl_facts
+                    WHERE errors IS NULL OR errors NOT IN ('duplicate', 'closed polyline', 'orphan')
+                ), points AS (
+                    SELECT p.fid, p.gid, (ST_Dump(ST_CollectionExtract(p.inter, 1))).geom AS geom
+                    FROM rcl_pairs p JOIN kept f ON f.eid = p.fid JOIN kept g ON g.eid = p.gid
+                ), located AS (
+                    SELECT pt.fid, pt.gid, pt.geom, fp.idx AS f_idx, gp.idx AS g_idx
+                    FROM points pt
+                    LEFT JOIN rcl_positions fp ON fp.eid = pt.fid AND fp.x = ST_X(pt.geom) AND fp.y = ST_Y(pt.geom)
+                    LEFT JOIN rcl_positions gp ON gp.eid = pt.gid AND gp.x = ST_X(pt.geom) AND gp.y = ST_Y(pt.geom)
+                ), vertex_points AS (
+                    -- (line with the vertex, line with the segment)
+                    SELECT fid, gid, geom, fid AS v_eid, f_idx AS idx, gid AS s_eid
+                    FROM located WHERE f_idx IS NOT NULL AND g_idx IS NULL
+                    UNION ALL
+                    SELECT fid, gid, geom, gid, g_idx, fid
+                    FROM located WHERE g_idx IS NOT NULL AND f_idx IS NULL
+                ), vertex_crossings AS (
+                    SELECT DISTINCT vp.fid, vp.gid, vp.geom
+                    FROM vertex_points vp JOIN rcl_lines l ON l.eid = vp.v_eid
+                    JOIN rcl_vertices prev ON prev.eid = vp.v_eid
+                        AND prev.idx = CASE WHEN vp.idx = 0 THEN l.n_vertices - 2 ELSE vp.idx - 1 END
+                    JOIN rcl_vertices next ON next.eid = vp.v_eid AND next.idx = vp.idx + 1
+                    JOIN rcl_vertices s1 ON s1.eid = vp.s_eid
+                    JOIN rcl_vertices s2 ON s2.eid = vp.s_eid AND s2.idx = s1.idx + 1
+                    WHERE (vp.idx > 0 OR ST_IsClosed(l.geom))
+                    -- the vertex is on the segment s1 s2
+                    AND (s2.x - s1.x) * (ST_Y(vp.geom) - s1.y) - (s2.y - s1.y) * (ST_X(vp.geom) - s1.x) = 0
+                    AND ST_X(vp.geom) BETWEEN least(s1.x, s2.x) AND greatest(s1.x, s2.x)
+                    AND ST_Y(vp.geom) BETWEEN least(s1.y, s2.y) AND greatest(s1.y, s2.y)
+                    -- and the vertices before and after it are on either side of the segment
+                    AND sign((s2.x - s1.x) * (prev.y - s1.y) - (s2.y - s1.y) * (prev.x - s1.x)) *
+                        sign((s2.x - s1.x) * (next.y - s1.y) - (s2.y - s1.y) * (next.x - s1.x)) < 0
+                ), crossings AS (
+                    SELECT fid, gid, geom FROM located WHERE f_idx IS NULL AND g_idx IS NULL
+                    UNION ALL
+                    SELECT fid, gid, geom FROM vertex_crossings
+                )
+                SELECT (row_number() OVER (ORDER BY c.fid, c.gid, ST_X(c.geom), ST_Y(c.geom)))::integer AS id,
+                       f.original_id AS line_id1, g.original_id AS line_id2,
+                       ST_X(c.geom) AS x, ST_Y(c.geom) AS y, c.geom::geometry(POINT, %(srid)s) AS geom
+                FROM crossings c JOIN rcl_lines f ON f.eid = c.fid JOIN rcl_lines g ON g.eid = c.gid;
+                CREATE INDEX %(unlinks_index)s ON %(unlinks_out)s USING GIST (geom);
+                ANALYZE %(unlinks_out)s;
+                """)
+            self.cur.execute(self.cur.mogrify("""SELECT count(*) FROM %(unlinks_out)s""", self.params))
+            unlinks = self.cur.fetchone()[0]
+            record['features'] += unlinks
+        return unlinks
+
+    def merge_pieces(self):
+        with self.profile.phase('postgis.merge_pieces') as record:
+            self.execute("""
+                -- of the pieces with the same geometry the one with the higher id is kept, as mergeTool
+                CREATE TEMP TABLE rcl_piece_duplicates AS
+                SELECT DISTINCT a.pid FROM rcl_pieces a JOIN rcl_pieces b
+                ON a.pid < b.pid AND a.geom && b.geom AND ST_Equals(a.geom, b.geom);
+
+                CREATE TEMP TABLE rcl_piece_ends AS
+                SELECT pid, ST_X(ST_StartPoint(geom)) AS x, ST_Y(ST_StartPoint(geom)) AS y,
+                       ST_X(ST_EndPoint(geom)) AS far_x, ST_Y(ST_EndPoint(geom)) AS far_y FROM rcl_pieces
+                UNION ALL
+                SELECT pid, ST_X(ST_EndPoint(geom)), ST_Y(ST_EndPoint(geom)),
+                       ST_X(ST_StartPoint(geom)), ST_Y(ST_StartPoint(geom)) FROM rcl_pieces;
+                CREATE INDEX rcl_piece_ends_xy_idx ON rcl_piece_ends (x, y);
+                ANALYZE rcl_piece_ends;
+
+                -- the nodes merged through: the degree (duplicates included) is 2 and the line turns by at
+                -- most angle_threshold, the angle is taken between the far ends of the two pieces
+                CREATE TEMP TABLE rcl_merge_nodes AS
+                WITH nodes AS (
+                    SELECT x, y, count(*) AS degree, array_agg(far_x - x) AS dx, array_agg(far_y - y) AS dy
+                    FROM rcl_piece_ends GROUP BY x, y
+                )
+                SELECT x, y FROM nodes
+                WHERE degree = 2 AND coalesce(
+                    180 - degrees(acos(greatest(-1.0, least(1.0, (dx[1] * dx[2] + dy[1] * dy[2]) /
+                        nullif(sqrt(dx[1] ^ 2 + dy[1] ^ 2) * sqrt(dx[2] ^ 2 + dy[2] ^ 2), 0))))) <= %(angle_threshold)s,
+                    false);
+
+                -- the pieces following each other through a merge node, at most one on each end of a piece
+                CREATE TEMP TABLE rcl_piece_links AS
+                SELECT DISTINCT a.pid, b.pid AS other
+                FROM rcl_piece_ends a JOIN rcl_merge_nodes n USING (x, y) JOIN rcl_piece_ends b USING (x, y)
+                WHERE a.pid <> b.pid
+                AND a.pid NOT IN (SELECT pid FROM rcl_piece_duplicates)
+                AND b.pid NOT IN (SELECT pid FROM rcl_piece_duplicates);
+                CREATE INDEX rcl_piece_links_pid_idx ON rcl_piece_links (pid);
+                ANALYZE rcl_piece_links;
+
+                -- every piece gets the lowest id of the chain it belongs to, the chains are walked from the
+                -- pieces with a free end and then the rings left are walked from each of their pieces
+                CREATE TEMP TABLE rcl_piece_chains AS
+                WITH RECURSIVE walk(pid, chain) AS (
+                    SELECT p.pid, p.pid FROM rcl_pieces p
+                    WHERE p.pid NOT IN (SELECT pid FROM rcl_piece_duplicates)
+                    AND (SELECT count(*) FROM rcl_piece_links l WHERE l.pid = p.pid) < 2
+                    UNION
+                    SELECT l.other, w.chain FROM walk w JOIN rcl_piece_links l ON l.pid = w.pid
+                )
+                SELECT pid, min(chain) AS chain FROM walk GROUP BY pid;
+
+                INSERT INTO rcl_piece_chains
+                WITH RECURSIVE walk(pid, chain) AS (
+                    SELECT p.pid, p.pid FROM rcl_pieces p
+                    WHERE p.pid NOT IN (SELECT pid FROM rcl_piece_duplicates)
+                    AND p.pid NOT IN (SELECT pid FROM rcl_piece_chains)
+                    UNION
+                    SELECT l.other, w.chain FROM walk w JOIN rcl_piece_links l ON l.pid = w.pid
+                )
+                SELECT pid, min(chain) FROM walk GROUP BY pid;
+                CREATE INDEX rcl_piece_chains_chain_idx ON rcl_piece_chains (chain);
+
+                -- each chain merged on its own (a chain closed at a node not merged through is one closed line)
+                CREATE TEMP TABLE rcl_merged AS
+                SELECT (row_number() OVER (ORDER BY m.chain))::integer AS mid, m.chain, m.geom FROM (
+                    SELECT c.chain, (ST_Dump(ST_LineMerge(ST_Collect(p.geom)))).geom AS geom
+                    FROM rcl_piece_chains c JOIN rcl_pieces p USING (pid)
+                    GROUP BY c.chain) m;
+                ALTER TABLE rcl_merged ADD PRIMARY KEY (mid);
+                CREATE INDEX rcl_merged_geom_idx ON rcl_merged USING GIST (geom);
+                ANALYZE rcl_merged;
+
+                CREATE TEMP TABLE rcl_merged_pieces AS
+                SELECT m.mid, p.pid, p.original_id
+                FROM rcl_merged m JOIN rcl_piece_chains c USING (chain) JOIN rcl_pieces p USING (pid);
+
+                -- orphans: the merged lines of the isolated parts of the network with at most orphan_edges
+                -- lines, or shorter than orphan_length, as mergeTool.exclude_orphans. The parts are the
+                -- clusters of the lines whose ends meet
+                CREATE TEMP TABLE rcl_orphans AS
+                WITH components AS (
+                    SELECT mid, ST_Length(geom) AS length,
+                           ST_ClusterDBSCAN(ST_Collect(ST_StartPoint(geom), ST_EndPoint(geom)), 0, 1) OVER () AS component
+                    FROM rcl_merged
+                ), orphan_components AS (
+                    SELECT component FROM components GROUP BY component
+                    HAVING count(*) <= %(orphan_edges)s OR coalesce(sum(length) < %(orphan_length)s, false)
+                )
+                SELECT mid FROM components WHERE component IN (SELECT component FROM orphan_components);
+
+                -- the attributes of the pieces of each line as arrays, as to_dblayer writes them
+                DROP TABLE IF EXISTS %(out)s;
+                CREATE TABLE %(out)s AS
+                SELECT %(attributes)s m.geom::geometry(LINESTRING, %(srid)s) AS geom
+                FROM rcl_merged m JOIN rcl_merged_pieces mp USING (mid)
+                JOIN %(src)s s ON s.%(id)s = mp.original_id
+                WHERE m.mid NOT IN (SELECT mid FROM rcl_orphans)
+                GROUP BY m.mid;
+                CREATE INDEX %(out_index)s ON %(out)s USING GIST (geom);
+                ANALYZE %(out)s;
+                """)
+            self.cur.execute(self.cur.mogrify("""SELECT count(*) FROM %(out)s""", self.params))
+            cleaned = self.cur.fetchone()[0]
+            record['features'] += cleaned
+        return cleaned
+
+    def write_errors(self):
+        with self.profile.phase('postgis.write_errors') as record:
+            # the errors of each input feature in the order the python tools find them,
+            # the pieces merged with others are continuous lines
+            self.execute("""
+                DROP TABLE IF EXISTS %(errors_out)s;
+                CREATE TABLE %(errors_out)s AS
+                WITH errors AS (
+                    SELECT original_id, 0 AS step, 0::bigint AS eid, errors FROM rcl_input_errors
+                    UNION ALL
+                    SELECT original_id, 1, eid, errors FROM rcl_facts WHERE errors IS NOT NULL
+                    UNION ALL
+                    SELECT mp.original_id, 2, 0, 'continuous line'
+                    FROM rcl_merged_pieces mp
+                    WHERE mp.mid IN (SELECT mid FROM rcl_merged_pieces GROUP BY mid HAVING count(*) > 1)
+                ), first_errors AS (
+                    SELECT DISTINCT ON (original_id, errors) original_id, step, eid, errors
+                    FROM errors ORDER BY original_id, errors, step, eid
+                )
+                SELECT e.original_id AS id_input, string_agg(e.errors, ', ' ORDER BY e.step, e.eid) AS errors,
+                       (SELECT ST_Force2D(s.%(geom)s) FROM %(src)s s WHERE s.%(id)s = e.original_id)::geometry(GEOMETRY, %(srid)s) AS geom
+                FROM first_errors e GROUP BY e.original_id;
+                CREATE INDEX %(errors_index)s ON %(errors_out)s USING GIST (geom);
+                ANALYZE %(errors_out)s;
+                """)
+            self.cur.execute(self.cur.mogrify("""SELECT count(*) FROM %(errors_out)s""", self.params))
+            errors = self.cur.fetchone()[0]
+            record['features'] += errors
+        return errors
+
+
+def quoted(*names):
+    # a (schema qualified) identifier for the queries
+    return '.'.join(['"%s"' % name.replace('"', '""') for name in names])
+
+
+def table_name(name, default_schema='public'):
+    # 'schema.table' or 'table' as (schema, table)
+    if '.' in name:
+        return tuple(name.split('.', 1))
+    return default_schema, name
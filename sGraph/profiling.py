@@ -0,0 +1,113 @@
+# general imports
+import os
+import sys
+import time
+import json
+from functools import wraps
+from contextlib import contextmanager
+
+try:
+    import resource
+    has_resource = True
+except ImportError, e:
+    has_resource = False
+
+
+def peak_rss():
+    # peak resident set size of the process in MB, None where it is not available (windows)
+    if not has_resource:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on mac, kilobytes on linux
+    if sys.platform == 'darwin':
+        return rss / 1048576.0
+    return rss / 1024.0
+
+
+class RunProfile(object):
+    """Per phase instrumentation of a cleaning run.
+
+    Every phase records its number of calls, wall time, cpu time, the peak
+    memory of the process when it ended, a feature count and how much each
+    counter (GEOS calls, spatial index queries) grew while it ran. Phases can
+    be nested and a phase entered several times accumulates its figures.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.order = []
+        self.counters = {}
+
+    def count(self, name, n=1):
+        try:
+            self.counters[name] += n
+        except KeyError:
+            self.counters[name] = n
+
+    def add_counters(self, counters):
+        # counters of another profile, e.g. of a worker process
+        for name, n in counters.items():
+            self.count(name, n)
+
+    def record(self, name):
+        try:
+            return self.phases[name]
+        except KeyError:
+            self.order.append(name)
+            self.phases[name] = {'name': name, 'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0,
+                                 'peak_rss_mb': None, 'features': 0, 'counters': {}}
+            return self.phases[name]
+
+    @contextmanager
+    def phase(self, name):
+        record = self.record(name)
+        counters = dict(self.counters)
+        wall_start = time.time()
+        cpu_start = sum(os.times()[:2])
+        try:
+            yield record
+        finally:
+            record['calls'] += 1
+            record['wall_time'] += time.time() - wall_start
+            record['cpu_time'] += sum(os.times()[:2]) - cpu_start
+            record['peak_rss_mb'] = peak_rss()
+            for counter, n in self.counters.items():
+                grown = n - counters.get(counter, 0)
+                if grown:
+                    record['counters'][counter] = record['counters'].get(counter, 0) + grown
+
+    def report(self):
+        return {'phases': [self.phases[name] for name in self.order], 'counters': self.counters}
+
+    def to_json(self, path=None):
+        report = json.dumps(self.report(), indent=2, sort_keys=True)
+        if path:
+            with open(path, 'w') as report_file:
+                report_file.write(report)
+        return report
+
+    def summary(self):
+        lines = ['%-24s %8s %10s %10s %10s %10s' % ('phase', 'calls', 'wall (s)', 'cpu (s)', 'peak (MB)', 'features')]
+        for name in self.order:
+            record = self.phases[name]
+            lines.append('%-24s %8d %10.2f %10.2f %10s %10d' % (
+                name, record['calls'], record['wall_time'], record['cpu_time'],
+                '%.1f' % record['peak_rss_mb'] if record['peak_rss_mb'] is not None else '-', record['features']))
+        for counter in sorted(self.counters.keys()):
+            lines.append('%s: %d' % (counter, self.counters[counter]))
+        return '\n'.join(lines)
+
+
+def profiled(name, features=None):
+    # runs a method of an object with a profile attribute as the phase name
+    # features(self, result) gives the number of features the call handled
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.profile.phase(name) as record:
+                result = method(self, *args, **kwargs)
+                if features is not None:
+                    record['features'] += features(self, result)
+            return result
+        return wrapper
+    return decorator
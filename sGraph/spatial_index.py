@@ -0,0 +1,133 @@
+# general imports
+import math
+from array import array
+
+
+class PackedRTree(object):
+    """Static R-tree bulk loaded with the Sort-Tile-Recursive algorithm.
+
+    The items are sorted once in STR order (vertical slices by x centre, each
+    slice by y centre) and packed node_size at a time into leaves; each upper
+    level groups node_size consecutive nodes of the level below. All the
+    bounding boxes live in one flat float64 array, level after level, so the
+    tree is compact, quick to build and can be pickled to worker processes.
+    It answers the same intersects() query as QgsSpatialIndex.
+    """
+
+    node_size = 16
+
+    def __init__(self, ids, bboxes):
+        # ids: sequence of item ids, bboxes: the matching (xmin, ymin, xmax, ymax)
+        ids = list(ids)
+        bboxes = list(bboxes)
+        order = str_order(bboxes, self.node_size)
+        self.ids = array('l', [ids[i] for i in order])
+        self.boxes = array('d')
+        for i in order:
+            self.boxes.extend(bboxes[i])
+        self.level_starts = [0]
+        self.level_sizes = [len(order)]
+        level_size = len(order)
+        while level_size > 1:
+            start = self.level_starts[-1]
+            for first in xrange(0, level_size, self.node_size):
+                last = min(first + self.node_size, level_size)
+                children = self.boxes[4 * (start + first): 4 * (start + last)]
+                self.boxes.extend([min(children[0::4]), min(children[1::4]), max(children[2::4]), max(children[3::4])])
+            self.level_starts.append(start + level_size)
+            level_size = int(math.ceil(level_size / float(self.node_size)))
+            self.level_sizes.append(level_size)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intersects(self, rect):
+        # ids of the items whose bounding box intersects (or touches) rect
+        # rect is (xmin, ymin, xmax, ymax) or a QgsRectangle
+        if hasattr(rect, 'xMinimum'):
+            rect = (rect.xMinimum(), rect.yMinimum(), rect.xMaximum(), rect.yMaximum())
+        xmin, ymin, xmax, ymax = rect
+        boxes = self.boxes
+        result = []
+        if not self.ids:
+            return result
+        top = len(self.level_sizes) - 1
+        stack = [(top, i) for i in xrange(self.level_sizes[top])]
+        while stack:
+            level, i = stack.pop()
+            pos = 4 * (self.level_starts[level] + i)
+            if boxes[pos] > xmax or boxes[pos + 1] > ymax or boxes[pos + 2] < xmin or boxes[pos + 3] < ymin:
+                continue
+            if level == 0:
+                result.append(self.ids[i])
+            else:
+                first = i * self.node_size
+                last = min(first + self.node_size, self.level_sizes[level - 1])
+                stack.extend([(level - 1, j) for j in xrange(first, last)])
+        return result
+
+
+class OverlayIndex(object):
+    """PackedRTree that takes insertions and deletions.
+
+    Inserted items are kept aside and scanned at every query, deleted items
+    are filtered out of the results of the tree. The tree is packed again
+    once the changes reach rebuild_share of its size.
+    """
+
+    rebuild_share = 0.1
+
+    def __init__(self, ids, bboxes):
+        self.bboxes = dict(zip(ids, bboxes))
+        self.rebuild()
+
+    def __len__(self):
+        return len(self.bboxes)
+
+    def rebuild(self):
+        ids = sorted(self.bboxes.keys())
+        self.tree = PackedRTree(ids, [self.bboxes[i] for i in ids])
+        self.inserted = {}
+        self.deleted = set()
+
+    def insert(self, item, bbox):
+        self.bboxes[item] = bbox
+        self.inserted[item] = bbox
+        # the tree may hold the item with its former bounding box
+        self.deleted.add(item)
+        self.check_rebuild()
+
+    def delete(self, item):
+        del self.bboxes[item]
+        self.inserted.pop(item, None)
+        self.deleted.add(item)
+        self.check_rebuild()
+
+    def check_rebuild(self):
+        if len(self.inserted) + len(self.deleted) > self.rebuild_share * max(len(self.tree), 1000):
+            self.rebuild()
+
+    def intersects(self, rect):
+        if hasattr(rect, 'xMinimum'):
+            rect = (rect.xMinimum(), rect.yMinimum(), rect.xMaximum(), rect.yMaximum())
+        xmin, ymin, xmax, ymax = rect
+        result = [item for item in self.tree.intersects(rect) if item not in self.deleted]
+        for item, bbox in self.inserted.items():
+            if not (bbox[0] > xmax or bbox[1] > ymax or bbox[2] < xmin or bbox[3] < ymin):
+                result.append(item)
+        return result
+
+
+def str_order(bboxes, node_size):
+    # Sort-Tile-Recursive order of the bounding boxes
+    n = len(bboxes)
+    n_leaves = int(math.ceil(n / float(node_size)))
+    n_slices = int(math.ceil(math.sqrt(n_leaves))) or 1
+    slice_size = n_slices * node_size
+    by_x = sorted(xrange(n), key=lambda i: bboxes[i][0] + bboxes[i][2])
+    order = []
+    for start in xrange(0, n, slice_size):
+        tile = by_x[start:start + slice_size]
+        tile.sort(key=lambda i: bboxes[i][1] + bboxes[i][3])
+        order.extend(tile)
+    return order
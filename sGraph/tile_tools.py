@@ -0,0 +1,34 @@
+# general imports
+import math
+
+
+def make_tiles(bboxes, n_tiles):
+    # splits the edges in a grid of about n_tiles tiles
+    # bboxes: {edge id: (xmin, ymin, xmax, ymax)}
+    # every edge is owned by the tile containing the centre of its bounding box
+    # returns the lists of edge ids owned by the non empty tiles, in ascending id order
+    if not bboxes:
+        return []
+    xmin = min(b[0] for b in bboxes.values())
+    ymin = min(b[1] for b in bboxes.values())
+    xmax = max(b[2] for b in bboxes.values())
+    ymax = max(b[3] for b in bboxes.values())
+    n_side = max(int(math.ceil(math.sqrt(n_tiles))), 1)
+    width = ((xmax - xmin) / n_side) or 1
+    height = ((ymax - ymin) / n_side) or 1
+    tiles = {}
+    for eid in sorted(bboxes.keys()):
+        b = bboxes[eid]
+        col = min(int(((b[0] + b[2]) / 2 - xmin) / width), n_side - 1)
+        row = min(int(((b[1] + b[3]) / 2 - ymin) / height), n_side - 1)
+        try:
+            tiles[(col, row)].append(eid)
+        except KeyError:
+            tiles[(col, row)] = [eid]
+    return [tiles[k] for k in sorted(tiles.keys())]
+
+
+def union_extent(bboxes):
+    # the extent of a tile, buffered so that it covers every edge it owns
+    return (min(b[0] for b in bboxes), min(b[1] for b in bboxes),
+            max(b[2] for b in bboxes), max(b[3] for b in bboxes))
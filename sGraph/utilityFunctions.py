@@ -1,8 +1,25 @@
 # general imports
 from qgis.core import QgsMapLayerRegistry, QgsVectorFileWriter, QgsVectorLayer, QgsFeature, QgsGeometry,QgsFields, QgsDataSourceURI
-import psycopg2
-from psycopg2.extensions import AsIs
+import os
 import math
+import struct
+import binascii
+import hashlib
+from cStringIO import StringIO
+from array import array
+
+try:
+    import numpy as np
+    has_numpy = True
+except ImportError, e:
+    has_numpy = False
+
+# only the postgis output needs psycopg2
+try:
+    import psycopg2
+    from psycopg2.extensions import AsIs
+except ImportError:
+    pass
 
 # source: ess utility functions
 
@@ -15,42 +32,20 @@ def getLayerByName(name):
     return layer
 
 
-def get_next_vertex(tree, all_con):
-    last = tree[-1]
-    return tree + [i for i in all_con[last] if i not in tree]
+def layer_content_hash(layer):
+    # sha1 of the ids, geometries and attributes of the features of a layer
+    content = hashlib.sha1()
+    for f in layer.getFeatures():
+        geom = f.geometry()
+        content.update('%s\x1e%s\x1e' % (f.id(), geom.exportToWkt() if geom else ''))
+        content.update(u'\x1f'.join([unicode(attr) for attr in f.attributes()]).encode('utf-8'))
+    return content.hexdigest()
 
 
-def keep_decimals_string(string, number_decimals):
-    integer_part = string.split(".")[0]
-    # if the input is an integer there is no decimal part
-    if len(string.split("."))== 1:
-        decimal_part = str(0)*number_decimals
-    else:
-        decimal_part = string.split(".")[1][0:number_decimals]
-    if len(decimal_part) < number_decimals:
-        zeros = str(0) * int((number_decimals - len(decimal_part)))
-        decimal_part = decimal_part + zeros
-    decimal = integer_part + '.' + decimal_part
-    return decimal
-
-
-def find_vertex_index(points, f_geom):
-    for point in points:
-        yield f_geom.asPolyline().index(point.asPoint())
+def is_same_length(geom1, geom2):
 
-
-def point_is_vertex(point, line):
-    #pl_l = line.asPolyline()
-    #try:
-    #    idx = pl_l.index(point.asPoint())
-    #    if idx == 0 or idx == (len(pl_l) - 1):
-    #        return True
-    #    else:
-    #        return False
-    #except ValueError:
-    #    return False
-    if point.asPoint() in line.asPolyline():
-        return True
+    # lengths of two geometries computed by geos may differ at the last digits
+    return abs(geom1.length() - geom2.length()) <= 1e-9 * max(geom1.length(), geom2.length(), 1)
 
 
 def vertices_from_wkt_2(wkt):
@@ -64,17 +59,82 @@ def vertices_from_wkt_2(wkt):
         yield vertex
 
 
-def make_snapped_wkt(wkt, number_decimals):
-    # TODO: check in different system if '(' is included
-    snapped_wkt = 'LINESTRING('
-    for i in vertices_from_wkt_2(wkt):
-        new_vertex = str(keep_decimals_string(i[0], number_decimals)) + ' ' + str(
-            keep_decimals_string(i[1], number_decimals))
-        snapped_wkt += str(new_vertex) + ', '
-    return snapped_wkt[0:-2] + ')'
+def edge_ends(wkt):
+    # first and last vertex as given by vertices_from_wkt_2, read from the ends of the wkt
+    # without splitting the other vertices
+    start = wkt.index('(') + 1
+    first = tuple(wkt[start:wkt.index(',', start)].strip().split(' '))
+    last = tuple(wkt[wkt.rindex(',') + 1:-1].strip().split(' '))
+    return first, last
+
+
+def wkt_length(wkt):
+    vertices = [(float(x), float(y)) for x, y in vertices_from_wkt_2(wkt)]
+    return sum([math.hypot(x1 - x0, y1 - y0) for (x0, y0), (x1, y1) in zip(vertices, vertices[1:])])
+
+
+def canonical_vertices(wkt):
+    # the vertices in the same order whichever the direction of the line: the
+    # vertices of lines with the same vertices give the same tuple
+    vertices = tuple(vertices_from_wkt_2(wkt))
+    return min(vertices, vertices[::-1])
+
+
+def wkt_from_vertices(vertices):
+    # vertices as given by vertices_from_wkt_2
+    return 'LINESTRING(' + ', '.join([vertex[0] + ' ' + vertex[1] for vertex in vertices]) + ')'
+
 
+def snap_coords(coords, number_decimals, mode='truncate'):
+    # snaps a flat array('d') of coordinates to number_decimals in one pass
+    # truncate: drop the extra decimals (the old string slicing behaviour)
+    # round: move every coordinate to the nearest point of the grid
+    scale = 10.0 ** number_decimals
+    snapped = array('d')
+    if has_numpy:
+        values = np.frombuffer(coords, dtype=np.float64) * scale
+        if mode == 'round':
+            values = np.floor(values + 0.5)
+        else:
+            # round first so that e.g. 1.23 * 100 = 122.99999999999999 is not truncated to 122
+            values = np.trunc(np.round(values, 6))
+        snapped.fromstring((values / scale).tostring())
+    else:
+        if mode == 'round':
+            snapped.extend([math.floor(c * scale + 0.5) / scale for c in coords])
+        else:
+            snapped.extend([float(int(round(c * scale, 6))) / scale for c in coords])
+    return snapped
+
+
+def make_features(any_features_list):
+    # QgsFeatures from [fid, attrs, geometry], the geometry as wkt or QgsGeometry
+    for i in any_features_list:
+        new_feat = QgsFeature()
+        new_feat.setFeatureId(i[0])
+        new_feat.setAttributes([attr[0] for attr in i[1]])
+        if isinstance(i[2], basestring):
+            new_feat.setGeometry(QgsGeometry.fromWkt(str(i[2])))
+        else:
+            new_feat.setGeometry(i[2])
+        yield new_feat
 
-def to_shp(path, any_features_list, layer_fields, crs, name, encoding, geom_type):
+
+def add_in_batches(pr, features, batch_size):
+    # each addFeatures call of the provider is written on its own (in one transaction where supported)
+    batch = []
+    for new_feat in features:
+        batch.append(new_feat)
+        if len(batch) == batch_size:
+            pr.addFeatures(batch)
+            batch = []
+    if batch:
+        pr.addFeatures(batch)
+
+
+def to_shp(path, any_features_list, layer_fields, crs, name, encoding, geom_type, batch_size=10000):
+    # any_features_list can be any iterable of [fid, attrs, geometry], the geometry as wkt or QgsGeometry
+    # features are written through the provider every batch_size features, without an edit buffer
     if path is None:
         if geom_type == 0:
             network = QgsVectorLayer('Point?crs=' + crs.toWkt(), name, "memory")
@@ -92,24 +152,92 @@ def to_shp(path, any_features_list, layer_fields, crs, name, encoding, geom_type
     pr = network.dataProvider()
     if path is None:
         pr.addAttributes(layer_fields)
-    new_features = []
-    for i in any_features_list:
-        new_feat = QgsFeature()
-        new_feat.setFeatureId(i[0])
-        new_feat.setAttributes([attr[0] for attr in i[1]])
-        new_feat.setGeometry(QgsGeometry(QgsGeometry.fromWkt(str(i[2]))))
-        #QgsGeometry()
-        new_features.append(new_feat)
-    network.startEditing()
-    pr.addFeatures(new_features)
-    network.commitChanges()
+        network.updateFields()
+    add_in_batches(pr, make_features(any_features_list), batch_size)
+    network.updateExtents()
+    return network
+
+
+def to_gpkg(path, any_features_list, layer_fields, crs, name, encoding, geom_type, batch_size=10000):
+    # the rtree of the layer is created with the layer and filled as the features are inserted,
+    # every batch is inserted in one transaction by the provider
+    fields = QgsFields()
+    for field in layer_fields:
+        fields.append(field)
+    file_writer = QgsVectorFileWriter(path, encoding, fields, geom_type, crs, "GPKG", [], ['SPATIAL_INDEX=YES'])
+    if file_writer.hasError() != QgsVectorFileWriter.NoError:
+        print "Error when creating geopackage: ", file_writer.errorMessage()
+        del file_writer
+        return None
+    del file_writer
+    network = QgsVectorLayer(path, name, "ogr")
+    add_in_batches(network.dataProvider(), make_features(any_features_list), batch_size)
+    network.updateExtents()
     return network
 
-def rmv_parenthesis(my_string):
-    idx = my_string.find(',ST_GeomFromText') - 1
-    return  my_string[:idx] + my_string[(idx+1):]
 
-def to_dblayer(dbname, user, host, port, password, schema, table_name, qgs_flds, any_features_list, crs):
+def to_fgb(path, any_features_list, layer_fields, crs, name, encoding, geom_type):
+    # flatgeobuf files are written once, in a stream, and the packed rtree is built when the writer closes
+    fields = QgsFields()
+    for field in layer_fields:
+        fields.append(field)
+    file_writer = QgsVectorFileWriter(path, encoding, fields, geom_type, crs, "FlatGeobuf", [], ['SPATIAL_INDEX=YES'])
+    if file_writer.hasError() != QgsVectorFileWriter.NoError:
+        # e.g. no FlatGeobuf driver before GDAL 3.1
+        print "Error when creating flatgeobuf: ", file_writer.errorMessage()
+        del file_writer
+        return None
+    for new_feat in make_features(any_features_list):
+        file_writer.addFeature(new_feat)
+    del file_writer
+    return QgsVectorLayer(path, name, "ogr")
+
+
+def to_file(path, any_features_list, layer_fields, crs, name, encoding, geom_type):
+    # picks the writer from the extension of path
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.gpkg':
+        return to_gpkg(path, any_features_list, layer_fields, crs, name, encoding, geom_type)
+    elif extension == '.fgb':
+        return to_fgb(path, any_features_list, layer_fields, crs, name, encoding, geom_type)
+    elif extension == '.shp':
+        return to_shp(path, any_features_list, layer_fields, crs, name, encoding, geom_type)
+    raise ValueError('Unknown output format %s: use .shp, .gpkg or .fgb' % (extension or 'without extension'))
+
+def ewkb_hex(vertices, srid):
+    # hex EWKB of a linestring with srid (little endian), as accepted by the geometry input of postgis
+    ewkb = struct.pack('<BIII', 1, 2 | 0x20000000, srid, len(vertices))
+    ewkb += struct.pack('<%sd' % (2 * len(vertices)), *[float(c) for vertex in vertices for c in vertex])
+    return binascii.hexlify(ewkb).upper()
+
+
+def copy_escape(value):
+    # escapes a value for the text format of COPY
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_array(values):
+    # postgres array literal of a list of attribute values, None for NULL
+    if values is None:
+        return '\\N'
+    items = []
+    for value in values:
+        if value is None:
+            items.append('NULL')
+        elif isinstance(value, bool):
+            items.append('t' if value else 'f')
+        elif isinstance(value, (int, long, float)):
+            items.append(repr(value) if isinstance(value, float) else str(value))
+        else:
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            else:
+                value = str(value)
+            items.append('"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"')
+    return copy_escape('{' + ','.join(items) + '}')
+
+
+def to_dblayer(dbname, user, host, port, password, schema, table_name, qgs_flds, any_features_list, crs, batch_size=10000):
 
     crs_id = str(crs.postgisSrid())
     connstring = "dbname=%s user=%s host=%s port=%s password=%s" % (dbname, user, host, port, password)
@@ -128,28 +256,38 @@ def to_dblayer(dbname, user, host, port, password, schema, table_name, qgs_flds,
         cur.execute(query)
         con.commit()
 
-        data = []
-
+        # rows are streamed with COPY in batches of batch_size, geometries as EWKB
+        copy_q = cur.mogrify("""COPY %s.%s FROM STDIN""", (AsIs(schema), AsIs(table_name)))
+        batch = StringIO()
+        batch_count = 0
         for (fid, attrs, wkt) in any_features_list:
-            for idx, l_attrs in enumerate(attrs):
+            row = []
+            for l_attrs in attrs:
                 if l_attrs:
-                    attrs[idx] = [i if i else None for i in l_attrs]
-                    if attrs[idx] == [None]:
-                        attrs[idx] = None
+                    l_attrs = [i if i else None for i in l_attrs]
+                    if l_attrs == [None]:
+                        l_attrs = None
                     else:
-                        attrs[idx] = [a for a in attrs[idx] if a]
-            data.append(tuple((attrs, wkt)))
-
-        args_str = ','.join(
-            [rmv_parenthesis(cur.mogrify("%s,ST_GeomFromText(%s,%s))", (tuple(attrs), wkt, AsIs(crs_id)))) for
-             (attrs, wkt) in tuple(data)])
+                        l_attrs = [a for a in l_attrs if a]
+                row.append(copy_array(l_attrs))
+            row.append(ewkb_hex(list(vertices_from_wkt_2(wkt)), int(crs_id)))
+            batch.write('\t'.join(row) + '\n')
+            batch_count += 1
+            if batch_count == batch_size:
+                batch.seek(0)
+                cur.copy_expert(copy_q, batch)
+                batch = StringIO()
+                batch_count = 0
+        if batch_count:
+            batch.seek(0)
+            cur.copy_expert(copy_q, batch)
+        con.commit()
 
-        ins_str = cur.mogrify("""INSERT INTO %s.%s VALUES """, (AsIs(schema), AsIs(table_name)))
-        cur.execute(ins_str + args_str)
+        # the spatial index is built after the load
+        cur.execute(cur.mogrify("""CREATE INDEX %s ON %s.%s USING GIST (geom); ANALYZE %s.%s""", (AsIs(table_name + '_geom_idx'), AsIs(schema), AsIs(table_name), AsIs(schema), AsIs(table_name))))
         con.commit()
         con.close()
 
-        print "success!"
         uri = QgsDataSourceURI()
         # set host name, port, database name, username and password
         uri.setConnection(host, port, dbname, user, password)
@@ -195,23 +333,28 @@ def getPostgisSchemas(connstring, commit=False):
     #return the result even if empty
     return sorted(schemas)
 
-def angle_3_points(inter_point, vertex1, vertex2):
-    inter_vertex1 = math.hypot(abs(float(inter_point[0]) - float(vertex1[0])),
-                               abs(float(inter_point[1]) - float(vertex1[1])))
-    inter_vertex2 = math.hypot(abs(float(inter_point[0]) - float(vertex2[0])),
-                               abs(float(inter_point[1]) - float(vertex2[1])))
-    vertex1_2 = math.hypot(abs(float(vertex1[0]) - float(vertex2[0])), abs(float(vertex1[1]) - float(vertex2[1])))
-    A = ((inter_vertex1 ** 2) + (inter_vertex2 ** 2) - (vertex1_2 ** 2))
-    B = (2 * inter_vertex1 * inter_vertex2)
-    if B != 0:
-        cos_angle = A / B
-    else:
-        cos_angle = NULL
-    if cos_angle < -1:
-        cos_angle = int(-1)
-    if cos_angle > 1:
-        cos_angle = int(1)
-    return math.degrees(math.acos(cos_angle))
+def deflection_angles(coords):
+    # deflections (180 - angle, in degrees) at a batch of nodes in one pass, from a flat array('d')
+    # node x, node y, x1, y1, x2, y2 per node, where 1 and 2 are the vertices the node joins
+    # a zero length side has no direction and gives a deflection of 180 (a full turn)
+    deflections = array('d')
+    if has_numpy:
+        values = np.frombuffer(coords, dtype=np.float64).reshape(-1, 6)
+        dx1, dy1 = values[:, 2] - values[:, 0], values[:, 3] - values[:, 1]
+        dx2, dy2 = values[:, 4] - values[:, 0], values[:, 5] - values[:, 1]
+        lengths = np.hypot(dx1, dy1) * np.hypot(dx2, dy2)
+        cos_angles = np.clip((dx1 * dx2 + dy1 * dy2) / np.where(lengths == 0, 1, lengths), -1, 1)
+        deflections.fromstring(np.where(lengths == 0, 180.0, 180.0 - np.degrees(np.arccos(cos_angles))).tostring())
+        return deflections
+    for i in xrange(0, len(coords), 6):
+        x, y, x1, y1, x2, y2 = coords[i:i + 6]
+        length = math.hypot(x1 - x, y1 - y) * math.hypot(x2 - x, y2 - y)
+        if length == 0:
+            deflections.append(180.0)
+        else:
+            cos_angle = min(1.0, max(-1.0, ((x1 - x) * (x2 - x) + (y1 - y) * (y2 - y)) / length))
+            deflections.append(180.0 - math.degrees(math.acos(cos_angle)))
+    return deflections
 
 
 
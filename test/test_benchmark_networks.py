@@ -0,0 +1,73 @@
+# coding=utf-8
+"""Synthetic networks and benchmark results test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'i.kolovou@spacesyntax.com'
+__date__ = '2017-06-01'
+__copyright__ = 'Copyright 2017, Space SyntaxLtd'
+
+import unittest
+
+from benchmark.networks import SCENARIOS, grid, with_duplicates, with_multiparts, scenario, feature_wkt
+from benchmark.results import compare_results
+
+
+class SyntheticNetworksTest(unittest.TestCase):
+    """Test the generators give the expected, reproducible networks."""
+
+    def test_grid(self):
+        """Rows cross every column, columns are cut in pieces."""
+        features = grid(3, spacing=10.0, pieces=2)
+        self.assertEqual(len(features), 4 + 4 * 3 * 2)
+        self.assertEqual(features[0], [[(0.0, 0.0), (10.0, 0.0), (20.0, 0.0), (30.0, 0.0)]])
+        self.assertEqual(features[4], [[(0.0, 0.0), (0.0, 5.0)]])
+
+    def test_reproducible(self):
+        """The same scenario gives the same network."""
+        for name in SCENARIOS:
+            self.assertEqual(scenario(name, 'small'), scenario(name, 'small'))
+
+    def test_modifiers(self):
+        """Duplicates are added and multiparts join consecutive features."""
+        features = grid(3)
+        self.assertEqual(len(with_duplicates(features, 1.0)), 2 * len(features))
+        joined = with_multiparts(features, 1.0)
+        self.assertEqual(len(joined), len(features) // 2)
+        self.assertEqual(len(joined[0]), 2)
+
+    def test_wkt(self):
+        """Single and multipart features are written as wkt."""
+        self.assertEqual(feature_wkt([[(0.0, 0.0), (1.0, 1.0)]]), 'LINESTRING(0.0 0.0, 1.0 1.0)')
+        self.assertEqual(feature_wkt([[(0.0, 0.0), (1.0, 1.0)], [(2.0, 2.0), (3.0, 3.0)]]),
+                         'MULTILINESTRING((0.0 0.0, 1.0 1.0), (2.0 2.0, 3.0 3.0))')
+
+
+class CompareResultsTest(unittest.TestCase):
+    """Test the regressions found against a baseline."""
+
+    def results(self, wall_time, geos_calls):
+        return {'runs': {'grid/small': {'phases': {'merge': {'wall_time': wall_time,
+                                                             'counters': {'geos_calls': geos_calls}}}}}}
+
+    def test_no_regression(self):
+        """Small or noisy changes are not regressions."""
+        self.assertEqual(compare_results(self.results(1.1, 110), self.results(1.0, 100)), [])
+        self.assertEqual(compare_results(self.results(0.03, 100), self.results(0.01, 100)), [])
+
+    def test_regression(self):
+        """Slower phases and more geos calls are regressions."""
+        regressions = compare_results(self.results(2.0, 200), self.results(1.0, 100))
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('grid/small merge'))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(SyntheticNetworksTest), unittest.makeSuite(CompareResultsTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,72 @@
+# coding=utf-8
+"""Break cache test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'i.kolovou@spacesyntax.com'
+__date__ = '2017-06-01'
+__copyright__ = 'Copyright 2017, Space SyntaxLtd'
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from sGraph.break_cache import BreakCache
+
+
+class BreakCacheTest(unittest.TestCase):
+    """Test entries are read back and the least recently used are evicted."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.cache_dir)
+
+    def test_keys(self):
+        """Keys depend on every part."""
+        cache = BreakCache(self.cache_dir)
+        self.assertEqual(cache.key('roads.shp', 'abc', 6), cache.key('roads.shp', 'abc', 6))
+        self.assertNotEqual(cache.key('roads.shp', 'abc', 6), cache.key('roads.shp', 'abc', 5))
+
+    def test_get_put(self):
+        """An entry is read back, a missing or broken one is None."""
+        cache = BreakCache(self.cache_dir)
+        entry = {'broken': [[1, [u'a'], 'LINESTRING(0 0, 1 1)']], 'unlinks': []}
+        cache.put('k1', entry)
+        self.assertEqual(cache.get('k1'), entry)
+        self.assertEqual(cache.get('k2'), None)
+        with open(cache.path('k3'), 'wb') as entry_file:
+            entry_file.write('partial')
+        self.assertEqual(cache.get('k3'), None)
+        self.assertFalse(os.path.exists(cache.path('k3')))
+
+    def test_eviction(self):
+        """The least recently used entries go when the cache is full."""
+        cache = BreakCache(self.cache_dir, max_size=1)
+        cache.put('k1', range(1000))
+        os.utime(cache.path('k1'), (time.time() - 10, time.time() - 10))
+        cache.max_size = 2 * os.path.getsize(cache.path('k1'))
+        cache.put('k2', range(1000))
+        os.utime(cache.path('k2'), (time.time() - 5, time.time() - 5))
+        # reading k1 makes k2 the least recently used
+        cache.get('k1')
+        cache.put('k3', range(1000))
+        self.assertEqual(cache.get('k2'), None)
+        self.assertEqual(cache.get('k1'), range(1000))
+        self.assertEqual(cache.get('k3'), range(1000))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(BreakCacheTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,58 @@
+# coding=utf-8
+"""Chain extraction test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'i.kolovou@spacesyntax.com'
+__date__ = '2017-06-01'
+__copyright__ = 'Copyright 2017, Space SyntaxLtd'
+
+import unittest
+
+from sGraph.chain_tools import find_chains, stitch_chain, connected_components
+
+
+class ChainToolsTest(unittest.TestCase):
+    """Test chains of edges connected through degree 2 nodes are found."""
+
+    def test_open_chain(self):
+        """Test a long chain is walked end to end without a length cap."""
+        n = 1000
+        all_con = {1: [2], n: [n - 1]}
+        for edge in range(2, n):
+            all_con[edge] = [edge - 1, edge + 1]
+        chains = find_chains(all_con)
+        self.assertEqual(len(chains), 1)
+        self.assertEqual(chains[0], range(1, n + 1))
+
+    def test_closed_ring(self):
+        """Test the edges of a ring are merged in one chain."""
+        all_con = {1: [2, 3], 2: [1, 3], 3: [2, 1], 4: [5], 5: [4]}
+        chains = find_chains(all_con)
+        self.assertEqual(chains, [[4, 5], [1, 2, 3]])
+
+    def test_stitch_chain(self):
+        """Test edges are concatenated and flipped where needed."""
+        polylines = [[('1', '0'), ('0', '0')], [('1', '0'), ('2', '0')], [('3', '0'), ('2', '0')]]
+        self.assertEqual(stitch_chain(polylines), [('0', '0'), ('1', '0'), ('2', '0'), ('3', '0')])
+
+    def test_stitch_disconnected(self):
+        """Test edges not sharing an end are left to geos."""
+        polylines = [[('0', '0'), ('1', '0')], [('2', '0'), ('3', '0')]]
+        self.assertIsNone(stitch_chain(polylines))
+
+    def test_connected_components(self):
+        """Test edges are grouped by the ends they share, directly or through other edges."""
+        ends = [(('0', '0'), ('1', '0')), (('5', '5'), ('6', '5')), (('1', '0'), ('2', '0')),
+                (('3', '3'), ('3', '3')), (('2', '0'), ('0', '0')), (('6', '5'), ('7', '5'))]
+        self.assertEqual(connected_components(ends), [0, 1, 0, 2, 0, 1])
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(ChainToolsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
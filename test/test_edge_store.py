@@ -0,0 +1,141 @@
+# coding=utf-8
+"""Edge store test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'i.kolovou@spacesyntax.com'
+__date__ = '2017-06-01'
+__copyright__ = 'Copyright 2017, Space SyntaxLtd'
+
+import os
+import unittest
+import shutil
+import tempfile
+from array import array
+
+from sGraph.edge_store import EdgeStore, SpilledArray, EdgeCache, coords_to_wkt
+
+
+class EdgeStoreTest(unittest.TestCase):
+    """Test the edges are stored and read back from the coordinate buffer."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.store = EdgeStore()
+        ref = self.store.add_attributes(['a', 1])
+        self.store.add_edge([(0.0, 0.0), (1.0, 0.0), (1.0, 1.5)], ref)
+        self.store.add_edge([(2.0, 2.0), (3.0, 3.0)], ref)
+
+    def test_ids(self):
+        """Test edge ids are 1-based and contiguous."""
+        self.assertEqual(list(self.store.ids()), [1, 2])
+        self.assertEqual(len(self.store), 2)
+
+    def test_vertices(self):
+        """Test vertex access by edge."""
+        self.assertEqual(self.store.vertex_count(1), 3)
+        self.assertEqual(self.store.vertices(2), [(2.0, 2.0), (3.0, 3.0)])
+        self.assertEqual(self.store.vertices(1, 1, 2), [(1.0, 0.0), (1.0, 1.5)])
+        self.assertEqual(self.store.vertex(1, -1), (1.0, 1.5))
+        self.assertEqual(self.store.bbox(1), (0.0, 0.0, 1.0, 1.5))
+
+    def test_shared_attributes(self):
+        """Test the parts of a feature share one attribute row."""
+        self.assertEqual(self.store.attributes_ref(1), self.store.attributes_ref(2))
+        self.assertEqual(self.store.attributes(2), ['a', 1])
+
+    def test_wkt(self):
+        """Test the wkt can be parsed back by vertices_from_wkt_2."""
+        self.assertEqual(self.store.wkt(1, 0, 1), 'LINESTRING(0.0 0.0, 1.0 0.0)')
+        self.assertEqual(coords_to_wkt([(0.1, 2)]), 'LINESTRING(0.1 2)')
+
+    def test_dump(self):
+        """Test an empty store loads the dump of another."""
+        store = EdgeStore()
+        store.load(self.store.dump())
+        self.assertEqual(list(store.ids()), [1, 2])
+        self.assertEqual(store.vertices(1), self.store.vertices(1))
+        self.assertEqual(store.attributes(2), ['a', 1])
+
+
+class SpilledEdgeStoreTest(unittest.TestCase):
+    """Test the edges are read back from the files of a spilled store."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.spill_dir = tempfile.mkdtemp()
+        self.buffer_size = SpilledArray.buffer_size
+        SpilledArray.buffer_size = 4
+
+    def tearDown(self):
+        """Runs after each test."""
+        SpilledArray.buffer_size = self.buffer_size
+        shutil.rmtree(self.spill_dir)
+
+    def test_spilled_edges(self):
+        """Test edges written across several flushes."""
+        store = EdgeStore(self.spill_dir)
+        for i in range(10):
+            ref = store.add_attributes([i, u'road %s' % i])
+            store.add_edge([(float(i), 0.0), (float(i), 1.0), (i + 0.5, 2.0)], ref)
+        store.add_coords(array('d', [20.0, 0.0, 21.0, 0.0]), array('l', [2]), array('l', [0]))
+        self.assertEqual(len(store), 11)
+        self.assertEqual(store.vertices(4), [(3.0, 0.0), (3.0, 1.0), (3.5, 2.0)])
+        self.assertEqual(store.vertices(11), [(20.0, 0.0), (21.0, 0.0)])
+        self.assertEqual(store.attributes(7), [6, u'road 6'])
+        self.assertEqual(store.bbox(10), (9.0, 0.0, 9.5, 2.0))
+        self.assertEqual(list(store.offsets)[-2:], [30, 32])
+        store.close()
+
+    def test_close(self):
+        """Test stores sharing a directory use their own files, removed when they are closed."""
+        first = EdgeStore(self.spill_dir)
+        second = EdgeStore(self.spill_dir)
+        first.add_edge([(0.0, 0.0), (1.0, 0.0)], first.add_attributes(['first']))
+        second.add_edge([(5.0, 5.0), (6.0, 5.0)], second.add_attributes(['second']))
+        self.assertEqual(first.vertices(1), [(0.0, 0.0), (1.0, 0.0)])
+        self.assertEqual(second.attributes(1), ['second'])
+        self.assertEqual(len(os.listdir(self.spill_dir)), 10)
+        first.close()
+        first.close()
+        self.assertEqual(len(os.listdir(self.spill_dir)), 5)
+        self.assertEqual(second.vertices(1), [(5.0, 5.0), (6.0, 5.0)])
+        second.close()
+        self.assertEqual(os.listdir(self.spill_dir), [])
+
+
+class EdgeCacheTest(unittest.TestCase):
+    """Test the cache makes each value once and keeps the last used ones."""
+
+    def test_least_recently_used(self):
+        """Test values are made once and the least recently used is dropped first."""
+        made = []
+
+        def make(eid):
+            made.append(eid)
+            return eid * 10
+
+        cache = EdgeCache(2)
+        self.assertEqual(cache.get(1, make), 10)
+        self.assertEqual(cache.get(2, make), 20)
+        self.assertEqual(cache.get(1, make), 10)
+        self.assertEqual(made, [1, 2])
+        cache.get(3, make)
+        self.assertEqual(len(cache), 2)
+        self.assertTrue(1 in cache)
+        self.assertFalse(2 in cache)
+        self.assertEqual(cache.peek(3), 30)
+        cache.drop(3)
+        self.assertIsNone(cache.peek(3))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(EdgeStoreTest), unittest.makeSuite(SpilledEdgeStoreTest),
+                                unittest.makeSuite(EdgeCacheTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
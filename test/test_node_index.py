@@ -0,0 +1,114 @@
+# coding=utf-8
+"""Vertex index test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'i.kolovou@spacesyntax.com'
+__date__ = '2017-06-01'
+__copyright__ = 'Copyright 2017, Space SyntaxLtd'
+
+import unittest
+
+from sGraph.edge_store import EdgeStore
+from sGraph.node_index import VertexIndex, polylines_touch_between_vertices, repeated_vertices, self_crosses, \
+    proper_crossings
+
+
+class VertexIndexTest(unittest.TestCase):
+    """Test shared vertices and contacts between vertices are found."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.store = EdgeStore()
+        ref = self.store.add_attributes([])
+        # a cross digitised with a shared middle vertex and a line touching it
+        self.store.add_edge([(0.0, 0.0), (1.0, 0.0), (2.0, 0.0)], ref)
+        self.store.add_edge([(1.0, -1.0), (1.0, 0.0), (1.0, 1.0)], ref)
+        self.store.add_edge([(2.0, 0.0), (3.0, 0.0)], ref)
+        self.index = VertexIndex(self.store)
+
+    def test_shared_vertices(self):
+        """Test the shared vertices of an edge are found by id and index."""
+        shared = self.index.shared_vertices(1, self.store.vertices(1))
+        self.assertEqual(shared, {2: set([1]), 3: set([2])})
+
+    def test_touch_at_vertices(self):
+        """Test lines meeting at shared vertices only do not need geos."""
+        self.assertFalse(polylines_touch_between_vertices(self.store.vertices(1), self.store.vertices(2)))
+        self.assertFalse(polylines_touch_between_vertices(self.store.vertices(1), self.store.vertices(3)))
+
+    def test_touch_between_vertices(self):
+        """Test crossings, t-junctions and overlaps are detected."""
+        line = [(0.0, 0.0), (2.0, 0.0)]
+        self.assertTrue(polylines_touch_between_vertices(line, [(1.0, -1.0), (1.0, 1.0)]))
+        self.assertTrue(polylines_touch_between_vertices(line, [(1.0, 0.0), (1.0, 1.0)]))
+        self.assertTrue(polylines_touch_between_vertices(line, [(1.0, 0.0), (3.0, 0.0)]))
+        self.assertTrue(polylines_touch_between_vertices(line, [(2.0, 0.0), (0.0, 0.0)]))
+        self.assertFalse(polylines_touch_between_vertices(line, [(3.0, 0.0), (4.0, 0.0)]))
+
+
+class SelfIntersectionTest(unittest.TestCase):
+    """Test repeated vertices and self crossings are found."""
+
+    def test_repeated_vertices(self):
+        """Test the first occurrence of each repeated vertex is returned."""
+        loop = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (1.0, 0.0), (2.0, 0.0)]
+        self.assertEqual(repeated_vertices(loop), [1])
+        ring = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 0.0)]
+        self.assertEqual(repeated_vertices(ring), [0])
+        self.assertEqual(repeated_vertices([(0.0, 0.0), (1.0, 0.0)]), [])
+
+    def test_self_crosses(self):
+        """Test crossings between vertices are found, rings and shared vertices are not crossings."""
+        figure_eight = [(0.0, 0.0), (2.0, 2.0), (2.0, 0.0), (0.0, 2.0)]
+        self.assertTrue(self_crosses(figure_eight))
+        ring = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0), (0.0, 0.0)]
+        self.assertFalse(self_crosses(ring))
+        loop = [(0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (2.0, 1.0), (1.0, 0.0), (2.0, 0.0)]
+        self.assertFalse(self_crosses(loop))
+        zigzag = [(float(i), float(i % 2)) for i in range(1000)]
+        self.assertFalse(self_crosses(zigzag))
+        self.assertTrue(self_crosses(zigzag + [(500.5, -1.0), (500.5, 2.0)]))
+        # segments following each other overlap where the line doubles back
+        self.assertTrue(self_crosses([(0.0, 0.0), (2.0, 0.0), (1.0, 0.0)]))
+        self.assertFalse(self_crosses([(0.0, 0.0), (1.0, 0.0), (2.0, 0.0)]))
+
+
+class CrossingsTest(unittest.TestCase):
+    """Test lines crossing without a common vertex are found by the sweep."""
+
+    def test_proper_crossings(self):
+        """Test crossings between segments are found, meetings at vertices are not."""
+        road = [(0.0, 0.0), (2.0, 0.0), (4.0, 0.0)]
+        bridge = [(1.0, -1.0), (1.0, 1.0)]
+        junction = [(2.0, 0.0), (2.0, 2.0)]
+        touch = [(3.0, 0.0), (3.0, 1.0)]
+        crossings = proper_crossings([(1, road), (2, bridge), (3, junction), (4, touch)])
+        self.assertEqual(crossings, [(1, 2, 1.0, 0.0)])
+        # a vertex of one line inside a segment of the other, the crossing is found once
+        road = [(0.0, 1.0), (1.0, 1.0), (2.0, 1.0)]
+        bridge = [(1.0, 0.0), (1.0, 2.0)]
+        self.assertEqual(proper_crossings([(1, road), (2, bridge)]), [(1, 2, 1.0, 1.0)])
+        self.assertEqual(proper_crossings([(2, bridge), (1, road)]), [(1, 2, 1.0, 1.0)])
+        # the line only touches the segment and turns back
+        touch = [(0.0, 0.0), (1.0, 1.0), (2.0, 0.0)]
+        self.assertEqual(proper_crossings([(1, touch), (2, [(0.0, 1.0), (2.0, 1.0)])]), [])
+        # the ends of a closed line are inside it too
+        ring = [(1.0, 1.0), (2.0, 2.0), (2.0, 0.0), (1.0, 1.0)]
+        self.assertEqual(proper_crossings([(1, ring), (2, [(0.0, 1.0), (2.0, 1.0)])]), [(1, 2, 1.0, 1.0)])
+
+    def test_same_line(self):
+        """Test the segments of one line are not tested against each other."""
+        loop = [(0.0, 0.0), (2.0, 0.0), (2.0, 1.0), (1.0, 1.0), (1.0, -1.0)]
+        self.assertEqual(proper_crossings([(1, loop)]), [])
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(VertexIndexTest), unittest.makeSuite(SelfIntersectionTest),
+                                unittest.makeSuite(CrossingsTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,99 @@
+# coding=utf-8
+"""PostGIS cleaning test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'i.kolovou@spacesyntax.com'
+__date__ = '2017-06-01'
+__copyright__ = 'Copyright 2017, Space SyntaxLtd'
+
+import os
+import unittest
+
+import psycopg2
+
+from utilities import get_qgis_app
+QGIS_APP = get_qgis_app()
+
+from sGraph.break_tools import breakTool
+from sGraph.merge_tools import mergeTool
+from sGraph.postgis_tools import postgisTool
+from sGraph.utilityFunctions import vertices_from_wkt_2
+from benchmark.run import network_layer
+
+# connection string of a database with postgis where the test tables can be created, e.g. 'dbname=test'
+TEST_DB = os.environ.get('ROAD_NETWORK_CLEANER_TEST_DB')
+
+# lines meeting at a node off the integer grid: snapped to integers they would move and meet elsewhere
+NETWORK = [[[(0.0, 0.0), (10.4, 0.3)]], [[(10.4, 0.3), (20.0, 0.6)]], [[(10.4, 0.3), (10.4, 10.2)]]]
+
+
+def canonical(vertices):
+    # the vertices of a line whichever its direction
+    vertices = tuple(vertices)
+    return min(vertices, vertices[::-1])
+
+
+class SnapExpressionTest(unittest.TestCase):
+    """Test the coordinates are snapped in sql only when breakTool snaps them."""
+
+    def test_no_tolerance(self):
+        """Test no tolerance and a tolerance of 0 leave the coordinates as they are."""
+        for tolerance in (None, 0):
+            cleaner = postgisTool('', 'public', 'network', tolerance, False, False)
+            self.assertEqual(cleaner.snap_expression('ST_X(p.geom)'), 'ST_X(p.geom)')
+        cleaner = postgisTool('', 'public', 'network', 2, False, False)
+        self.assertNotEqual(cleaner.snap_expression('ST_X(p.geom)'), 'ST_X(p.geom)')
+
+
+@unittest.skipUnless(TEST_DB, 'ROAD_NETWORK_CLEANER_TEST_DB is not set')
+class EnginesTest(unittest.TestCase):
+    """Test the database and the python tools clean a network the same way."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.con = psycopg2.connect(TEST_DB)
+        cur = self.con.cursor()
+        cur.execute("""DROP TABLE IF EXISTS public.rnc_test_network;
+                       CREATE TABLE public.rnc_test_network (id integer PRIMARY KEY, geom geometry(LINESTRING, 27700))""")
+        for fid, parts in enumerate(NETWORK, start=1):
+            cur.execute("""INSERT INTO public.rnc_test_network VALUES (%s, ST_GeomFromText(%s, 27700))""",
+                        (fid, 'LINESTRING(%s)' % ', '.join(['%r %r' % vertex for vertex in parts[0]])))
+        self.con.commit()
+
+    def tearDown(self):
+        """Runs after each test."""
+        cur = self.con.cursor()
+        cur.execute("""DROP TABLE IF EXISTS public.rnc_test_network, public.rnc_test_cleaned""")
+        self.con.commit()
+        self.con.close()
+
+    def python_lines(self, tolerance):
+        br = breakTool(network_layer(NETWORK, 'network'), tolerance, None, False, False)
+        br.add_edges()
+        merged_features = mergeTool(br.break_features(), None, False).merge()
+        return sorted([canonical([(float(x), float(y)) for x, y in vertices_from_wkt_2(wkt)])
+                       for fid, attrs, wkt in merged_features])
+
+    def database_lines(self, tolerance):
+        postgisTool(TEST_DB, 'public', 'rnc_test_network', tolerance, False, False).clean('public', 'rnc_test_cleaned')
+        cur = self.con.cursor()
+        cur.execute("""SELECT array_agg(ST_X(d.geom) ORDER BY d.path), array_agg(ST_Y(d.geom) ORDER BY d.path)
+                       FROM public.rnc_test_cleaned c, ST_DumpPoints(c.geom) d GROUP BY c.ctid""")
+        return sorted([canonical(zip(xs, ys)) for xs, ys in cur.fetchall()])
+
+    def test_tolerance_zero(self):
+        """Test a tolerance of 0 does not snap the coordinates in either engine."""
+        self.assertEqual(self.database_lines(0), self.python_lines(0))
+        self.assertEqual(self.database_lines(None), self.python_lines(None))
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(SnapExpressionTest), unittest.makeSuite(EnginesTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,69 @@
+# coding=utf-8
+"""Run profile test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'i.kolovou@spacesyntax.com'
+__date__ = '2017-06-01'
+__copyright__ = 'Copyright 2017, Space SyntaxLtd'
+
+import json
+import unittest
+
+from sGraph.profiling import RunProfile, profiled
+
+
+class Worker(object):
+
+    def __init__(self):
+        self.profile = RunProfile()
+
+    @profiled('work', features=lambda self, result: len(result))
+    def work(self, n):
+        self.profile.count('geos_calls', n)
+        return range(n)
+
+
+class RunProfileTest(unittest.TestCase):
+    """Test the phases and counters of a run profile."""
+
+    def test_repeated_phase_accumulates(self):
+        """A phase entered twice sums its calls, features and counters."""
+        worker = Worker()
+        worker.work(3)
+        worker.work(4)
+        record = worker.profile.phases['work']
+        self.assertEqual(record['calls'], 2)
+        self.assertEqual(record['features'], 7)
+        self.assertEqual(record['counters'], {'geos_calls': 7})
+        self.assertTrue(record['wall_time'] >= 0)
+
+    def test_nested_phases(self):
+        """Counters grow in every open phase, phases are reported in order."""
+        worker = Worker()
+        with worker.profile.phase('run'):
+            worker.work(2)
+            worker.profile.count('index_queries')
+        report = json.loads(worker.profile.to_json())
+        self.assertEqual([phase['name'] for phase in report['phases']], ['run', 'work'])
+        self.assertEqual(report['phases'][0]['counters'], {'geos_calls': 2, 'index_queries': 1})
+        self.assertEqual(report['phases'][1]['counters'], {'geos_calls': 2})
+        self.assertEqual(report['counters'], {'geos_calls': 2, 'index_queries': 1})
+
+    def test_worker_counters(self):
+        """Counters of another profile are added to the totals."""
+        profile = RunProfile()
+        profile.count('geos_calls')
+        profile.add_counters({'geos_calls': 5, 'index_queries': 2})
+        self.assertEqual(profile.counters, {'geos_calls': 6, 'index_queries': 2})
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(RunProfileTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
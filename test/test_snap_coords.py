@@ -0,0 +1,81 @@
+# coding=utf-8
+"""Snapping test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'i.kolovou@spacesyntax.com'
+__date__ = '2017-06-01'
+__copyright__ = 'Copyright 2017, Space SyntaxLtd'
+
+import unittest
+from array import array
+
+from utilities import get_qgis_app
+QGIS_APP = get_qgis_app()
+
+from sGraph import utilityFunctions
+from sGraph.utilityFunctions import snap_coords
+
+
+def keep_decimals_string(string, number_decimals):
+    # the string slicing the coordinates were snapped with before snap_coords
+    integer_part = string.split(".")[0]
+    if len(string.split(".")) == 1:
+        decimal_part = str(0) * number_decimals
+    else:
+        decimal_part = string.split(".")[1][0:number_decimals]
+    if len(decimal_part) < number_decimals:
+        decimal_part = decimal_part + str(0) * (number_decimals - len(decimal_part))
+    return integer_part + '.' + decimal_part
+
+
+class SnapCoordsTest(unittest.TestCase):
+    """Test the coordinates are snapped as the wkt strings were, with and without numpy."""
+
+    coords = [1.23, -1.23, 0.5, -0.5, 2.0, -2.0, 1.239, -1.239, 12345.6789, -12345.6789, 0.29, 0.07, 4.35]
+
+    def setUp(self):
+        """Runs before each test."""
+        self.has_numpy = utilityFunctions.has_numpy
+
+    def tearDown(self):
+        """Runs after each test."""
+        utilityFunctions.has_numpy = self.has_numpy
+
+    def snap(self, coords, number_decimals, mode, numpy):
+        utilityFunctions.has_numpy = self.has_numpy and numpy
+        return list(snap_coords(array('d', coords), number_decimals, mode))
+
+    def test_truncate(self):
+        """Test truncating matches the string slicing, negative coordinates and 1.23 * 100 included."""
+        for numpy in (True, False):
+            for number_decimals in (1, 2, 3):
+                expected = [float(keep_decimals_string(repr(c), number_decimals)) for c in self.coords]
+                self.assertEqual(self.snap(self.coords, number_decimals, 'truncate', numpy), expected)
+            # 1.23 * 100 is 122.99999999999999
+            self.assertEqual(self.snap([1.23, -1.23], 2, 'truncate', numpy), [1.23, -1.23])
+            # halfway points are truncated towards zero, on both sides of it
+            self.assertEqual(self.snap([0.5, -0.5, 1.5, -1.5, 2.5, -2.5], 0, 'truncate', numpy),
+                             [0.0, 0.0, 1.0, -1.0, 2.0, -2.0])
+            self.assertEqual(self.snap([0.25, -0.25, 0.75, -0.75], 1, 'truncate', numpy), [0.2, -0.2, 0.7, -0.7])
+
+    def test_round(self):
+        """Test rounding moves the coordinates to the nearest point of the grid."""
+        for numpy in (True, False):
+            self.assertEqual(self.snap([1.239, -1.239, 1.231, -1.231], 2, 'round', numpy),
+                             [1.24, -1.24, 1.23, -1.23])
+            # halfway points go up, negative ones towards zero
+            self.assertEqual(self.snap([0.5, -0.5, 1.5, -1.5, 2.5, -2.5], 0, 'round', numpy),
+                             [1.0, 0.0, 2.0, -1.0, 3.0, -2.0])
+            self.assertEqual(self.snap([0.25, -0.25, 0.75, -0.75], 1, 'round', numpy), [0.3, -0.2, 0.8, -0.7])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(SnapCoordsTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,70 @@
+# coding=utf-8
+"""Packed R-tree test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'i.kolovou@spacesyntax.com'
+__date__ = '2017-06-01'
+__copyright__ = 'Copyright 2017, Space SyntaxLtd'
+
+import random
+import unittest
+
+from sGraph.spatial_index import PackedRTree, OverlayIndex
+
+
+class PackedRTreeTest(unittest.TestCase):
+    """Test the packed tree answers the same queries as a linear scan."""
+
+    def setUp(self):
+        """Runs before each test."""
+        rnd = random.Random(0)
+        self.bboxes = {}
+        for eid in range(1, 2001):
+            x, y = rnd.uniform(0, 1000), rnd.uniform(0, 1000)
+            self.bboxes[eid] = (x, y, x + rnd.uniform(0, 20), y + rnd.uniform(0, 20))
+        self.tree = PackedRTree(self.bboxes.keys(), self.bboxes.values())
+
+    def test_queries(self):
+        """Test random windows against a linear scan."""
+        rnd = random.Random(1)
+        for i in range(50):
+            x, y = rnd.uniform(0, 1000), rnd.uniform(0, 1000)
+            rect = (x, y, x + 50, y + 50)
+            expected = [eid for eid, b in self.bboxes.items()
+                        if not (b[0] > rect[2] or b[1] > rect[3] or b[2] < rect[0] or b[3] < rect[1])]
+            self.assertEqual(sorted(self.tree.intersects(rect)), sorted(expected))
+
+    def test_touching(self):
+        """Test boxes touching the query window are returned."""
+        tree = PackedRTree([1, 2], [(0, 0, 1, 1), (1, 1, 2, 2)])
+        self.assertEqual(sorted(tree.intersects((1, 1, 1, 1))), [1, 2])
+        self.assertEqual(PackedRTree([], []).intersects((0, 0, 1, 1)), [])
+
+
+class OverlayIndexTest(unittest.TestCase):
+    """Test the overlay index follows insertions and deletions."""
+
+    def test_changes(self):
+        """Test queries after deleting, moving and inserting items, before and after a rebuild."""
+        index = OverlayIndex([1, 2, 3], [(0, 0, 1, 1), (2, 2, 3, 3), (4, 4, 5, 5)])
+        index.delete(2)
+        index.insert(3, (0, 0, 1, 1))
+        index.insert(4, (2, 2, 3, 3))
+        self.assertEqual(sorted(index.intersects((0, 0, 1, 1))), [1, 3])
+        self.assertEqual(sorted(index.intersects((2, 2, 3, 3))), [4])
+        self.assertEqual(index.intersects((4, 4, 5, 5)), [])
+        index.rebuild()
+        self.assertEqual(sorted(index.intersects((0, 0, 1, 1))), [1, 3])
+        self.assertEqual(sorted(index.intersects((2, 2, 3, 3))), [4])
+        self.assertEqual(len(index), 3)
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(PackedRTreeTest), unittest.makeSuite(OverlayIndexTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
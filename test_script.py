@@ -35,6 +35,7 @@ br.add_edges()
 fields = br.layer_fields
 
 broken_features = br.break_features()
+br.find_unlinks(broken_features)
 
 unlinks = to_shp(None, br.unlinked_features, [QgsField('id', QVariant.Int), QgsField('line_id1', QVariant.String), QgsField('line_id2', QVariant.String), QgsField('x', QVariant.Double), QgsField('y', QVariant.Double)], crs,'unlinks', encoding, 0)
 QgsMapLayerRegistry.instance().addMapLayer(unlinks)